@@ -0,0 +1,106 @@
+# coding=utf-8
+import collections
+import re
+import threading
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from CTFd.cache import cache
+from CTFd.models import Flags
+from CTFd.plugins.flags import get_flag_class
+
+# 传给自定义 flag 类型 compare() 的只读副本, 不持有数据库会话
+FlagData = collections.namedtuple('FlagData', ['id', 'challenge_id', 'type', 'content', 'data'])
+
+
+class Flag_utils(object):
+    # 每道题目预编译的 flag 匹配器
+    # static flag 放入集合 O(1) 判断, regex flag 预先编译, 其他类型的 flag 仍交给 CTFd 的 flag 类比较.
+    # Flags 修改提交后更新共享缓存中该题的版本号, 各 worker 在下一次提交时重建
+    key_prefix = 'plugin_awd_flags_version_'
+    max_size = 512
+
+    _matchers = collections.OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _build(challenge_id):
+        static = set()
+        static_ci = set()
+        regex = []
+        others = []
+        for flag in Flags.query.filter_by(challenge_id=challenge_id).all():
+            case_insensitive = flag.data == 'case_insensitive'
+            if flag.type == 'static':
+                if case_insensitive:
+                    static_ci.add(flag.content.lower())
+                else:
+                    static.add(flag.content)
+                continue
+            if flag.type == 'regex':
+                try:
+                    regex.append(re.compile(flag.content, re.IGNORECASE if case_insensitive else 0))
+                    continue
+                except re.error:
+                    pass
+            others.append(FlagData(flag.id, flag.challenge_id, flag.type, flag.content, flag.data))
+        return frozenset(static), frozenset(static_ci), tuple(regex), tuple(others)
+
+    @staticmethod
+    def _get_matcher(challenge_id):
+        key = Flag_utils.key_prefix + str(challenge_id)
+        version = cache.get(key)
+        if version is not None:
+            with Flag_utils._lock:
+                entry = Flag_utils._matchers.get(challenge_id)
+                if entry is not None and entry[0] == version:
+                    Flag_utils._matchers.move_to_end(challenge_id)
+                    return entry[1]
+        else:
+            version = str(uuid.uuid4())
+            cache.set(key, version, timeout=0)
+
+        # 先确定版本号再查询, 查询期间的修改会让这份匹配器在下一次调用时失效
+        matcher = Flag_utils._build(challenge_id)
+        with Flag_utils._lock:
+            Flag_utils._matchers[challenge_id] = (version, matcher)
+            Flag_utils._matchers.move_to_end(challenge_id)
+            while len(Flag_utils._matchers) > Flag_utils.max_size:
+                Flag_utils._matchers.popitem(last=False)
+        return matcher
+
+    @staticmethod
+    def compare(challenge_id, submission):
+        static, static_ci, regex, others = Flag_utils._get_matcher(challenge_id)
+        if submission in static:
+            return True
+        if static_ci and submission.lower() in static_ci:
+            return True
+        for pattern in regex:
+            res = pattern.match(submission)
+            if res and res.group() == submission:
+                return True
+        for flag in others:
+            if get_flag_class(flag.type).compare(flag, submission):
+                return True
+        return False
+
+    @staticmethod
+    def _flag_changed(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('plugin_awd_flag_changes', set()).add(target.challenge_id)
+
+    @staticmethod
+    def _after_commit(session):
+        # 事务提交后才更新版本号, 避免其他 worker 用未提交的数据重建匹配器
+        for challenge_id in session.info.pop('plugin_awd_flag_changes', ()):
+            cache.set(Flag_utils.key_prefix + str(challenge_id), str(uuid.uuid4()), timeout=0)
+
+    @staticmethod
+    def register_listeners():
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(Flags, name, Flag_utils._flag_changed)
+        event.listen(Session, 'after_commit', Flag_utils._after_commit)
@@ -0,0 +1,143 @@
+# coding=utf-8
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class Http_utils(object):
+    # 转发 flag 到 AWD 平台的共享 HTTP 会话
+    # 所有提交复用同一个 keep-alive 连接池, 连接/读取都有超时, 连接失败和 502/503/504 有限次退避重试.
+    # 每个上游主机一个熔断器: 连续失败 breaker_threshold 次后 breaker_cooldown 秒内直接失败,
+    # 冷却结束后只放行一个试探请求, 成功则恢复. 调用方可用 breaker_key 使用单独的熔断器
+    user_agent = 'Mozilla/5.0 (iPhone; CPU iPhone OS 11_0 like Mac OS X) AppleWebKit'
+    connect_timeout = 3.0
+    read_timeout = 5.0
+    retries = 2
+    backoff = 0.3
+    pool_size = 20
+    breaker_threshold = 5
+    breaker_cooldown = 30.0
+
+    _session = None
+    _breakers = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def init_app(app):
+        Http_utils.configure(
+            connect_timeout=app.config.get('AWD_HTTP_CONNECT_TIMEOUT'),
+            read_timeout=app.config.get('AWD_HTTP_READ_TIMEOUT'),
+            retries=app.config.get('AWD_HTTP_RETRIES'),
+            backoff=app.config.get('AWD_HTTP_BACKOFF'),
+            pool_size=app.config.get('AWD_HTTP_POOL_SIZE'),
+            breaker_threshold=app.config.get('AWD_BREAKER_THRESHOLD'),
+            breaker_cooldown=app.config.get('AWD_BREAKER_COOLDOWN'),
+        )
+
+    @staticmethod
+    def configure(connect_timeout=None, read_timeout=None, retries=None, backoff=None, pool_size=None,
+                  breaker_threshold=None, breaker_cooldown=None):
+        if connect_timeout:
+            Http_utils.connect_timeout = float(connect_timeout)
+        if read_timeout:
+            Http_utils.read_timeout = float(read_timeout)
+        if retries is not None:
+            Http_utils.retries = int(retries)
+        if backoff is not None:
+            Http_utils.backoff = float(backoff)
+        if pool_size:
+            Http_utils.pool_size = int(pool_size)
+        if breaker_threshold:
+            Http_utils.breaker_threshold = int(breaker_threshold)
+        if breaker_cooldown:
+            Http_utils.breaker_cooldown = float(breaker_cooldown)
+        with Http_utils._lock:
+            if Http_utils._session is not None:
+                Http_utils._session.close()
+            Http_utils._session = None
+
+    @staticmethod
+    def get_session():
+        with Http_utils._lock:
+            if Http_utils._session is None:
+                retry = Retry(
+                    total=Http_utils.retries,
+                    connect=Http_utils.retries,
+                    read=0,
+                    backoff_factor=Http_utils.backoff,
+                    status_forcelist=(502, 503, 504),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=Http_utils.pool_size,
+                    pool_maxsize=Http_utils.pool_size,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.headers['User-Agent'] = Http_utils.user_agent
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                Http_utils._session = session
+            return Http_utils._session
+
+    @staticmethod
+    def _before_request(host):
+        now = time.time()
+        with Http_utils._lock:
+            breaker = Http_utils._breakers.get(host)
+            if breaker is None or breaker['open_until'] is None:
+                return
+            if breaker['open_until'] > now:
+                raise CircuitOpenError(host)
+            # 冷却结束: 放行这一个试探请求, 其余请求继续快速失败直到它返回
+            breaker['open_until'] = now + Http_utils.breaker_cooldown
+
+    @staticmethod
+    def _after_request(host, ok):
+        with Http_utils._lock:
+            breaker = Http_utils._breakers.setdefault(host, {'failures': 0, 'open_until': None})
+            if ok:
+                breaker['failures'] = 0
+                breaker['open_until'] = None
+                return
+            breaker['failures'] += 1
+            if breaker['failures'] >= Http_utils.breaker_threshold:
+                breaker['open_until'] = time.time() + Http_utils.breaker_cooldown
+
+    @staticmethod
+    def get(url, params=None, breaker_key=None):
+        host = breaker_key or urlsplit(url).netloc
+        Http_utils._before_request(host)
+        try:
+            response = Http_utils.get_session().get(
+                url, params=params, timeout=(Http_utils.connect_timeout, Http_utils.read_timeout)
+            )
+        except requests.RequestException:
+            Http_utils._after_request(host, False)
+            raise
+        Http_utils._after_request(host, response.status_code < 500)
+        return response
+
+    @staticmethod
+    def get_breakers():
+        now = time.time()
+        with Http_utils._lock:
+            return dict(
+                (host, {
+                    'failures': b['failures'],
+                    'open': b['open_until'] is not None and b['open_until'] > now,
+                })
+                for host, b in Http_utils._breakers.items()
+            )
@@ -0,0 +1,178 @@
+# coding=utf-8
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+
+class Queue_utils(object):
+    # AWD 提交的本地持久化队列 (store-and-forward)
+    # 提交先写入 SQLite 日志并立即返回编号, 后台线程按 rate 条/秒的速度转发到 AWD 平台.
+    # 多个 worker 共享同一个数据库文件, 领取任务在 BEGIN IMMEDIATE 事务中完成, 同一条提交只会被一个
+    # 线程发送; 发送中途退出的 worker 留下的记录超过 claim_timeout 秒后重新排队.
+    # 上游没有给出明确结果时按指数退避重试 (最多间隔 max_backoff 秒), 排队超过 max_age 秒仍未送达才标记为 failed.
+    # 熔断器打开时没有真正请求上游, 不计入尝试次数
+    mode = 'direct'
+    rate = 10.0
+    max_age = 600
+    max_backoff = 30
+    claim_timeout = 60
+    batch_size = 20
+    path = None
+
+    _send = None
+    _local = threading.local()
+    _thread = None
+    _worker_id = None
+
+    @staticmethod
+    def init_app(app, send):
+        # send(challenge_id, url, token, flag) -> (结果, 是否为明确结果), 熔断时第二项为 None
+        Queue_utils._send = send
+        Queue_utils.path = app.config.get('AWD_QUEUE_PATH') or os.path.join(
+            app.config.get('LOG_FOLDER') or tempfile.gettempdir(), 'plugin-awd-queue.sqlite3'
+        )
+        Queue_utils.configure(
+            mode=app.config.get('AWD_SUBMIT_MODE'),
+            rate=app.config.get('AWD_QUEUE_RATE'),
+            max_age=app.config.get('AWD_QUEUE_MAX_AGE'),
+            max_backoff=app.config.get('AWD_QUEUE_MAX_BACKOFF'),
+        )
+
+    @staticmethod
+    def configure(mode=None, rate=None, max_age=None, max_backoff=None):
+        if rate:
+            Queue_utils.rate = float(rate)
+        if max_age:
+            Queue_utils.max_age = int(max_age)
+        if max_backoff:
+            Queue_utils.max_backoff = int(max_backoff)
+        Queue_utils.mode = mode if mode in ('queue', 'auto') else 'direct'
+        if Queue_utils.mode == 'direct' and not os.path.exists(Queue_utils.path):
+            return
+        # 切回 direct 模式时仍然把已经排队的提交发送完
+        Queue_utils._connect()
+        if Queue_utils._thread is None or not Queue_utils._thread.is_alive():
+            Queue_utils._worker_id = '{0}-{1}'.format(os.getpid(), uuid.uuid4())
+            Queue_utils._thread = threading.Thread(target=Queue_utils._run, name='plugin-awd-queue')
+            Queue_utils._thread.daemon = True
+            Queue_utils._thread.start()
+
+    @staticmethod
+    def _connect():
+        conn = getattr(Queue_utils._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(Queue_utils.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(Queue_utils.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS submissions ('
+                'id TEXT PRIMARY KEY, user_id INTEGER, challenge_id INTEGER, url TEXT, token TEXT, flag TEXT, '
+                'status TEXT, success INTEGER, msg TEXT, attempts INTEGER DEFAULT 0, '
+                'created REAL, updated REAL, next_try REAL, claimed_by TEXT)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_submissions_status ON submissions (status, next_try)')
+            Queue_utils._local.conn = conn
+        return conn
+
+    @staticmethod
+    def enqueue(user_id, challenge_id, url, token, flag):
+        submission_id = str(uuid.uuid4())
+        now = time.time()
+        Queue_utils._connect().execute(
+            'INSERT INTO submissions (id, user_id, challenge_id, url, token, flag, status, created, updated, next_try) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (submission_id, user_id, challenge_id, url, token, flag, 'queued', now, now, now)
+        )
+        return submission_id
+
+    @staticmethod
+    def get(submission_id):
+        row = Queue_utils._connect().execute(
+            'SELECT id, user_id, challenge_id, status, success, msg, attempts, created, updated '
+            'FROM submissions WHERE id = ?', (submission_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        result['success'] = bool(result['success']) if result['success'] is not None else None
+        return result
+
+    @staticmethod
+    def _claim():
+        conn = Queue_utils._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                "UPDATE submissions SET status = 'queued', claimed_by = NULL "
+                "WHERE status = 'sending' AND updated < ?", (now - Queue_utils.claim_timeout,)
+            )
+            rows = conn.execute(
+                "SELECT id, challenge_id, url, token, flag, attempts, created FROM submissions "
+                "WHERE status = 'queued' AND next_try <= ? ORDER BY created LIMIT ?",
+                (now, Queue_utils.batch_size)
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    "UPDATE submissions SET status = 'sending', claimed_by = ?, updated = ? WHERE id IN ({0})".format(
+                        ', '.join('?' * len(rows))
+                    ),
+                    [Queue_utils._worker_id, now] + [row['id'] for row in rows]
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    @staticmethod
+    def _finish(row, result, definitive):
+        now = time.time()
+        attempts = row['attempts'] + (0 if definitive is None else 1)
+        if definitive:
+            status, next_try = 'done', None
+        elif now - row['created'] >= Queue_utils.max_age:
+            status, next_try = 'failed', None
+        else:
+            status, next_try = 'queued', now + min(Queue_utils.max_backoff, 2 ** max(attempts, 1))
+        Queue_utils._connect().execute(
+            'UPDATE submissions SET status = ?, success = ?, msg = ?, attempts = ?, updated = ?, next_try = ?, '
+            'claimed_by = NULL WHERE id = ? AND claimed_by = ?',
+            (status, int(result['success']), result.get('msg'), attempts, now, next_try,
+             row['id'], Queue_utils._worker_id)
+        )
+
+    @staticmethod
+    def _run():
+        while True:
+            try:
+                rows = Queue_utils._claim()
+            except Exception:
+                rows = []
+            if not rows:
+                time.sleep(1)
+                continue
+            for row in rows:
+                started = time.time()
+                try:
+                    result, definitive = Queue_utils._send(row['challenge_id'], row['url'], row['token'], row['flag'])
+                    Queue_utils._finish(row, result, definitive)
+                except Exception:
+                    # 数据库或发送异常: 记录留在 sending 状态, 超时后重新排队
+                    pass
+                delay = 1.0 / Queue_utils.rate - (time.time() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    @staticmethod
+    def get_stats():
+        rows = Queue_utils._connect().execute(
+            'SELECT status, COUNT(*) FROM submissions GROUP BY status'
+        ).fetchall()
+        return dict((row[0], row[1]) for row in rows)
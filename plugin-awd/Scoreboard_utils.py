@@ -0,0 +1,93 @@
+# coding=utf-8
+import hashlib
+import threading
+import time
+
+import requests
+
+from .Http_utils import CircuitOpenError, Http_utils
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+
+class Scoreboard_utils(object):
+    # AWD 平台排行榜的缓存代理
+    # ttl 秒内直接返回缓存; 过期但未超过 stale 秒时先返回旧内容, 同时由一个后台线程刷新;
+    # 没有可用缓存时同步获取, 同一题目同一时间只有一个上游请求, 其他请求等待它的结果.
+    # 上游失败时继续返回旧内容. 每个 worker 对上游的请求频率不超过 1/ttl.
+    # 排行榜使用单独的熔断器, 排行榜失败不会让同一主机的 flag 转发快速失败, 反之亦然
+    ttl = 5.0
+    stale = 60.0
+    wait_timeout = 10.0
+
+    _entries = {}
+    _inflight = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def init_app(app):
+        if app.config.get('AWD_SCOREBOARD_TTL'):
+            Scoreboard_utils.ttl = float(app.config.get('AWD_SCOREBOARD_TTL'))
+        if app.config.get('AWD_SCOREBOARD_STALE'):
+            Scoreboard_utils.stale = float(app.config.get('AWD_SCOREBOARD_STALE'))
+
+    @staticmethod
+    def _fetch(challenge_id, url):
+        try:
+            try:
+                response = Http_utils.get(url, breaker_key='scoreboard:' + urlsplit(url).netloc)
+            except (CircuitOpenError, requests.RequestException):
+                return
+            if response.status_code != 200:
+                return
+            body = response.content
+            entry = {
+                'body': body,
+                'content_type': response.headers.get('Content-Type', 'text/html; charset=utf-8'),
+                'etag': hashlib.sha1(body).hexdigest(),
+                'url': url,
+                'fetched_at': time.time(),
+            }
+            with Scoreboard_utils._lock:
+                Scoreboard_utils._entries[challenge_id] = entry
+        finally:
+            with Scoreboard_utils._lock:
+                event = Scoreboard_utils._inflight.pop(challenge_id, None)
+            if event is not None:
+                event.set()
+
+    @staticmethod
+    def get(challenge_id, url):
+        # 返回缓存项 (dict) 或 None
+        now = time.time()
+        with Scoreboard_utils._lock:
+            entry = Scoreboard_utils._entries.get(challenge_id)
+            if entry is not None and entry['url'] != url:
+                entry = None
+            age = now - entry['fetched_at'] if entry is not None else None
+            if age is not None and age < Scoreboard_utils.ttl:
+                return entry
+            event = Scoreboard_utils._inflight.get(challenge_id)
+            leader = event is None
+            if leader:
+                event = Scoreboard_utils._inflight[challenge_id] = threading.Event()
+
+        if age is not None and age < Scoreboard_utils.ttl + Scoreboard_utils.stale:
+            if leader:
+                thread = threading.Thread(target=Scoreboard_utils._fetch, args=(challenge_id, url))
+                thread.daemon = True
+                thread.start()
+            return entry
+
+        if leader:
+            Scoreboard_utils._fetch(challenge_id, url)
+        else:
+            event.wait(Scoreboard_utils.wait_timeout)
+        with Scoreboard_utils._lock:
+            latest = Scoreboard_utils._entries.get(challenge_id)
+        if latest is not None and latest['url'] == url:
+            return latest
+        return entry
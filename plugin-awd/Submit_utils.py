@@ -0,0 +1,105 @@
+# coding=utf-8
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .Http_utils import CircuitOpenError, Http_utils
+from .Queue_utils import Queue_utils
+from .Verdict_utils import Verdict_utils
+
+
+class Submit_utils(object):
+    # 把 flag 转发到题目设置的 AWD 平台提交地址
+    # 批量提交通过有界线程池并发转发, 同一时间最多 max_workers 个上游请求,
+    # 一次批量提交的耗时接近一次上游往返而不是 N 次. 重复提交的 flag 直接使用 Verdict_utils 中缓存的结果.
+    # queue 模式下提交全部写入 Queue_utils 由后台发送; auto 模式下只有上游没有给出明确结果时才排队
+    max_workers = 8
+    max_batch = 100
+
+    _executor = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def init_app(app):
+        Queue_utils.init_app(app, Submit_utils._send_queued)
+        Submit_utils.configure(
+            max_workers=app.config.get('AWD_BATCH_WORKERS'),
+            max_batch=app.config.get('AWD_BATCH_MAX'),
+        )
+
+    @staticmethod
+    def configure(max_workers=None, max_batch=None):
+        if max_batch:
+            Submit_utils.max_batch = int(max_batch)
+        max_workers = int(max_workers) if max_workers else Submit_utils.max_workers
+        with Submit_utils._lock:
+            if Submit_utils._executor is not None and max_workers == Submit_utils.max_workers:
+                return
+            old = Submit_utils._executor
+            Submit_utils.max_workers = max_workers
+            Submit_utils._executor = ThreadPoolExecutor(max_workers=max_workers)
+        if old is not None:
+            old.shutdown(wait=False)
+
+    @staticmethod
+    def submit(challenge_id, url, token, flag, user_id=None):
+        result = Verdict_utils.get(challenge_id, token, flag)
+        if result is not None:
+            return result
+        if Queue_utils.mode == 'queue':
+            return Submit_utils._enqueue(user_id, challenge_id, url, token, flag)
+        result, definitive = Submit_utils._forward(url, token, flag)
+        if definitive:
+            Verdict_utils.set(challenge_id, token, flag, result)
+        elif Queue_utils.mode == 'auto':
+            return Submit_utils._enqueue(user_id, challenge_id, url, token, flag)
+        return result
+
+    @staticmethod
+    def _enqueue(user_id, challenge_id, url, token, flag):
+        submission_id = Queue_utils.enqueue(user_id, challenge_id, url, token, flag)
+        return {
+            'success': False,
+            'queued': True,
+            'id': submission_id,
+            'msg': 'Your flag has been accepted for delivery. Check its status later with the id ' + submission_id + '.',
+        }
+
+    @staticmethod
+    def _send_queued(challenge_id, url, token, flag):
+        # 后台发送线程调用, 明确结果同样写入去重缓存
+        result, definitive = Submit_utils._forward(url, token, flag)
+        if definitive:
+            Verdict_utils.set(challenge_id, token, flag, result)
+        return result, definitive
+
+    @staticmethod
+    def _forward(url, token, flag):
+        # 返回 (结果, 是否为上游给出的明确结果); 熔断器打开、没有请求上游时第二项为 None
+        try:
+            response = Http_utils.get(url, params={'token': token.strip(), 'flag': flag.strip()})
+        except CircuitOpenError:
+            return {'success': False, 'msg': 'The flag submission service is temporarily unavailable. Please try again later.'}, None
+        except requests.RequestException:
+            response = None
+
+        if response is not None and response.status_code == 200:
+            if response.text.find('success') != -1:
+                return {'success': True}, True
+            return {'success': False, 'msg': response.text}, True
+        return {'success': False, 'msg': 'There is a problem with the address you set for submitting the flag. Please check and reset itself.'}, False
+
+    @staticmethod
+    def submit_many(challenge_id, url, token, flags, user_id=None):
+        # 结果与 flags 一一对应, 保持提交顺序
+        futures = [
+            Submit_utils._executor.submit(Submit_utils.submit, challenge_id, url, token, flag, user_id)
+            for flag in flags
+        ]
+        results = []
+        for flag, future in zip(flags, futures):
+            result = dict(future.result())
+            result['flag'] = flag
+            results.append(result)
+        return results
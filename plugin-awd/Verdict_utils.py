@@ -0,0 +1,95 @@
+# coding=utf-8
+import collections
+import threading
+import time
+
+
+class Verdict_utils(object):
+    # AWD 提交结果的去重缓存
+    # 以 (题目, 队伍 token, flag) 为键缓存上游给出的明确结果 (HTTP 200 的成功或拒绝), 攻击脚本重复提交同一个
+    # flag 时直接返回缓存结果, 不再请求 AWD 平台. 设置了 round_length 时键中带上轮次编号,
+    # 缓存不会跨轮次存活; 轮次从 round_offset (任意一轮开始时的 Unix 时间戳) 起算. 超时、熔断等非明确结果不缓存
+    ttl = 300
+    max_size = 10000
+    round_length = 0
+    round_offset = 0
+
+    _verdicts = collections.OrderedDict()
+    _stats = {'hits': 0, 'misses': 0}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def init_app(app):
+        Verdict_utils.configure(
+            ttl=app.config.get('AWD_VERDICT_CACHE_TTL'),
+            max_size=app.config.get('AWD_VERDICT_CACHE_SIZE'),
+            round_length=app.config.get('AWD_ROUND_LENGTH'),
+            round_offset=app.config.get('AWD_ROUND_OFFSET'),
+        )
+
+    @staticmethod
+    def configure(ttl=None, max_size=None, round_length=None, round_offset=None):
+        if ttl is not None:
+            Verdict_utils.ttl = int(ttl)
+        if max_size:
+            Verdict_utils.max_size = int(max_size)
+        if round_length is not None:
+            Verdict_utils.round_length = int(round_length)
+        if round_offset is not None:
+            Verdict_utils.round_offset = int(round_offset)
+        with Verdict_utils._lock:
+            Verdict_utils._verdicts.clear()
+
+    @staticmethod
+    def _key(challenge_id, token, flag, now):
+        round_no = int((now - Verdict_utils.round_offset) // Verdict_utils.round_length) if Verdict_utils.round_length > 0 else None
+        return (str(challenge_id), token.strip(), flag.strip(), round_no)
+
+    @staticmethod
+    def get(challenge_id, token, flag):
+        if Verdict_utils.ttl <= 0:
+            return None
+        now = time.time()
+        key = Verdict_utils._key(challenge_id, token, flag, now)
+        with Verdict_utils._lock:
+            entry = Verdict_utils._verdicts.get(key)
+            if entry is not None and entry[0] > now:
+                Verdict_utils._verdicts.move_to_end(key)
+                Verdict_utils._stats['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                del Verdict_utils._verdicts[key]
+            Verdict_utils._stats['misses'] += 1
+        return None
+
+    @staticmethod
+    def set(challenge_id, token, flag, result):
+        if Verdict_utils.ttl <= 0:
+            return
+        now = time.time()
+        key = Verdict_utils._key(challenge_id, token, flag, now)
+        expires = now + Verdict_utils.ttl
+        if Verdict_utils.round_length > 0:
+            # 不超过本轮结束时间
+            expires = min(expires, Verdict_utils.round_offset + (key[3] + 1) * Verdict_utils.round_length)
+        with Verdict_utils._lock:
+            Verdict_utils._verdicts[key] = (expires, result)
+            Verdict_utils._verdicts.move_to_end(key)
+            while len(Verdict_utils._verdicts) > Verdict_utils.max_size:
+                Verdict_utils._verdicts.popitem(last=False)
+
+    @staticmethod
+    def get_stats():
+        with Verdict_utils._lock:
+            hits = Verdict_utils._stats['hits']
+            misses = Verdict_utils._stats['misses']
+            size = len(Verdict_utils._verdicts)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / float(hits + misses) if hits + misses else 0.0,
+            'size': size,
+            'ttl': Verdict_utils.ttl,
+            'round_length': Verdict_utils.round_length,
+            'round_offset': Verdict_utils.round_offset,
+        }
@@ -5,9 +5,8 @@ import math
 import uuid
 import json
 from datetime import datetime
-import requests
 
-from flask import Blueprint, render_template, request
+from flask import Blueprint, Response, g, render_template, request
 
 from CTFd.models import (
     ChallengeFiles,
@@ -20,13 +19,20 @@ from CTFd.models import (
     db,
 )
 from CTFd.plugins import register_plugin_assets_directory
+from CTFd.plugins.migrations import upgrade
 from CTFd.plugins.challenges import CHALLENGE_CLASSES, BaseChallenge
-from CTFd.plugins.flags import get_flag_class
 from CTFd.utils.modes import get_model
 from CTFd.utils.uploads import delete_file
-from CTFd.utils.user import get_ip
+from CTFd.utils.user import get_ip, is_admin
 from CTFd.utils import user as current_user
 from CTFd.utils.decorators import admins_only, authed_only
+from .Flag_utils import Flag_utils
+from .Fails_utils import Fails_utils
+from .Http_utils import Http_utils
+from .Submit_utils import Submit_utils
+from .Verdict_utils import Verdict_utils
+from .Queue_utils import Queue_utils
+from .Scoreboard_utils import Scoreboard_utils
 
 
 
@@ -89,6 +95,7 @@ class PulginAwdChallenge(BaseChallenge):
             "max_attempts": challenge.max_attempts,
             "type": challenge.type,
             "url": challenge.flag_submission,
+            "scoreboard": bool(challenge.scoreboard),
             "type_data": {
                 "id": PulginAwdChallenge.id,
                 "name": PulginAwdChallenge.name,
@@ -149,10 +156,20 @@ class PulginAwdChallenge(BaseChallenge):
         """
         data = request.form or request.get_json()
         submission = data["submission"].strip()
-        flags = Flags.query.filter_by(challenge_id=challenge.id).all()
-        for flag in flags:
-            if get_flag_class(flag.type).compare(flag, submission):
-                return True, "Correct"
+        # 缓冲中尚未写入数据库的错误提交也计入尝试次数, 用尽时直接拒绝, 不记录 Fails
+        if challenge.max_attempts and Fails_utils.enabled:
+            account_id = current_user.get_current_user().account_id
+            pending = Fails_utils.pending_count(account_id, challenge.id)
+            if pending:
+                fails = Fails.query.filter(
+                    Fails.account_id == account_id, Fails.challenge_id == challenge.id
+                ).count()
+                if fails + pending >= challenge.max_attempts:
+                    g.plugin_awd_refused = True
+                    return False, "You have 0 tries remaining"
+        # 使用预编译的匹配器, 常见情况下不查询 Flags
+        if Flag_utils.compare(challenge.id, submission):
+            return True, "Correct"
         return False, "Incorrect"
 
     @staticmethod
@@ -190,8 +207,19 @@ class PulginAwdChallenge(BaseChallenge):
         :param request: The request the user submitted
         :return:
         """
+        if g.get("plugin_awd_refused"):
+            return
         data = request.form or request.get_json()
         submission = data["submission"].strip()
+        if Fails_utils.enabled:
+            Fails_utils.add(
+                user_id=user.id,
+                team_id=team.id if team else None,
+                challenge_id=challenge.id,
+                ip=get_ip(request),
+                provided=submission,
+            )
+            return
         wrong = Fails(
             user_id=user.id,
             team_id=team.id if team else None,
@@ -208,6 +236,7 @@ class AwdChallengeExc(Challenges):
     __mapper_args__ = {"polymorphic_identity": "plugin-awd"}
     id = db.Column(None, db.ForeignKey("challenges.id"), primary_key=True)
     flag_submission = db.Column(db.Text, default=0)
+    scoreboard = db.Column(db.Text)
 
     def __init__(self, *args, **kwargs):
         super(AwdChallengeExc, self).__init__(**kwargs)
@@ -215,9 +244,26 @@ class AwdChallengeExc(Challenges):
 
 
 def load(app):
-    # upgrade()
     app.db.create_all()
+    upgrade()
     CHALLENGE_CLASSES["plugin-awd"] = PulginAwdChallenge
+    # Flags 修改后使对应题目的匹配器失效
+    Flag_utils.register_listeners()
+    # 错误提交的写后缓冲, 默认关闭
+    Fails_utils.init_app(
+        app, "plugin-awd",
+        enabled=app.config.get("AWD_FAIL_BUFFER", False),
+        max_rows=app.config.get("AWD_FAIL_BUFFER_SIZE"),
+        interval=app.config.get("AWD_FAIL_BUFFER_INTERVAL"),
+    )
+    # 转发 flag 的共享连接池, 超时/重试/熔断参数来自 AWD_HTTP_* 配置
+    Http_utils.init_app(app)
+    # 批量提交的并发转发线程池, 以及 AWD_SUBMIT_MODE 为 queue/auto 时的本地发送队列
+    Submit_utils.init_app(app)
+    # 重复提交的结果缓存, AWD_VERDICT_CACHE_TTL 为 0 时关闭
+    Verdict_utils.init_app(app)
+    # AWD 排行榜代理的缓存时间
+    Scoreboard_utils.init_app(app)
     register_plugin_assets_directory(
         app, base_path="/plugins/plugin-awd/assets/"
     )
@@ -241,25 +287,71 @@ def load(app):
         team = req.get("submission_team")
         flag = req.get("submission_flag")
         url = AwdChallengeExc.query.filter_by(id=challenge_id).first().flag_submission
-        url = url + "?token=" + team.strip() + "&flag=" + flag.strip()
-        flag_request = requests.request('get', url, headers={'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 11_0 like Mac OS X) AppleWebKit'})
-
-        if flag_request.status_code == 200:
-            if flag_request.text.find('success') != -1:
-                return json.dumps({'success': True})
-            else:
-                msg = flag_request.text
-                return json.dumps({'success': False, 'msg': msg})
-
-        return json.dumps({'success': False, 'msg': 'There is a problem with the address you set for submitting the flag. Please check and reset itself.'})
-
-
-   
-
-
-
-
-
-
-
+        user_id = current_user.get_current_user().id
+        return json.dumps(Submit_utils.submit(challenge_id, url, team, flag, user_id))
 
+    @app.route('/flag-submission-batch', methods=['POST'])
+    @authed_only
+    def flag_submission_batch():
+        # 一次提交多个 flag: {"challenge_id": 1, "submission_team": "team1", "submission_flags": ["flag{..}", ...]}
+        req = request.get_json()
+        challenge_id = req.get("challenge_id")
+        team = req.get("submission_team")
+        flags = req.get("submission_flags") or []
+        if not isinstance(team, str) or not team.strip():
+            return json.dumps({'success': False, 'msg': 'No team token submitted.'})
+        if not isinstance(flags, list) or not flags:
+            return json.dumps({'success': False, 'msg': 'No flags submitted.'})
+        if not all(isinstance(f, str) for f in flags):
+            return json.dumps({'success': False, 'msg': 'Every flag must be a string.'})
+        if len(flags) > Submit_utils.max_batch:
+            return json.dumps({'success': False, 'msg': 'Too many flags, at most {0} per batch.'.format(Submit_utils.max_batch)})
+        challenge = AwdChallengeExc.query.filter_by(id=challenge_id).first()
+        if challenge is None:
+            return json.dumps({'success': False, 'msg': 'Challenge not found.'})
+        results = Submit_utils.submit_many(
+            challenge.id, challenge.flag_submission, team, flags, current_user.get_current_user().id
+        )
+        return json.dumps({
+            'success': True,
+            'accepted': sum(1 for r in results if r['success']),
+            'results': results,
+        })
+
+    @app.route('/admin/flag-submission-cache', methods=['GET'])
+    @admins_only
+    def flag_submission_cache_stats():
+        return json.dumps({'success': True, 'stats': Verdict_utils.get_stats()})
+
+    @app.route('/flag-submission-status', methods=['GET'])
+    @authed_only
+    def flag_submission_status():
+        submission = Queue_utils.get(request.args.get("id"))
+        if submission is None or (submission['user_id'] != current_user.get_current_user().id and not is_admin()):
+            return json.dumps({'success': False, 'msg': 'Submission not found.'})
+        return json.dumps({'success': True, 'submission': submission})
+
+    @app.route('/admin/flag-submission-queue', methods=['GET'])
+    @admins_only
+    def flag_submission_queue_stats():
+        return json.dumps({'success': True, 'mode': Queue_utils.mode, 'stats': Queue_utils.get_stats()})
+
+    @app.route('/awd-scoreboard/<int:challenge_id>', methods=['GET'])
+    @authed_only
+    def awd_scoreboard(challenge_id):
+        challenge = AwdChallengeExc.query.filter_by(id=challenge_id).first()
+        if challenge is None or not challenge.scoreboard:
+            return json.dumps({'success': False, 'msg': 'This challenge has no scoreboard.'}), 404
+        entry = Scoreboard_utils.get(challenge.id, challenge.scoreboard)
+        if entry is None:
+            return json.dumps({'success': False, 'msg': 'The scoreboard is temporarily unavailable. Please try again later.'}), 502
+        # 上游页面不可信, 在沙箱中渲染, 不能以 CTFd 的源执行脚本
+        headers = {
+            'ETag': '"' + entry['etag'] + '"',
+            'Cache-Control': 'private, max-age={0}'.format(int(Scoreboard_utils.ttl)),
+            'Content-Security-Policy': 'sandbox',
+            'X-Content-Type-Options': 'nosniff',
+        }
+        if request.if_none_match.contains(entry['etag']):
+            return Response(status=304, headers=headers)
+        return Response(entry['body'], content_type=entry['content_type'], headers=headers)
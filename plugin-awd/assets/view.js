@@ -259,6 +259,12 @@ CTFd._internal.challenge.submit = function() {
                 body: "Submitted successfully",
                 button: "OK"
             });
+        } else if (response.queued) {
+            CTFd.ui.ezq.ezAlert({
+                title: "Queued",
+                body: response.msg,
+                button: "OK"
+            });
         } else {
             
             CTFd.ui.ezq.ezAlert({
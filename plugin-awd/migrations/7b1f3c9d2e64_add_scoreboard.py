@@ -0,0 +1,26 @@
+"""Add scoreboard to awd_challenge_exc
+
+Revision ID: 7b1f3c9d2e64
+Revises:
+Create Date: 2026-10-18 16:05:21.731482
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "7b1f3c9d2e64"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    # 新安装时 create_all 已经建好了这一列
+    inspector = sa.inspect(op.get_bind())
+    columns = [c["name"] for c in inspector.get_columns("awd_challenge_exc")]
+    if "scoreboard" not in columns:
+        op.add_column("awd_challenge_exc", sa.Column("scoreboard", sa.Text(), nullable=True))
+
+
+def downgrade(op=None):
+    op.drop_column("awd_challenge_exc", "scoreboard")
@@ -0,0 +1,21 @@
+# coding=utf-8
+import uuid
+
+from CTFd.cache import cache
+
+
+class Cache_utils(object):
+    # 进程内缓存的版本戳
+    # 版本号保存在 CTFd 的共享缓存 (生产环境为 Redis) 中, 数据修改时更新版本号,
+    # 各 worker 只需一次缓存读取即可判断自己的进程内缓存是否过期
+    key_prefix = 'plugin_dynamic_version_'
+
+    @staticmethod
+    def get_version(name):
+        return cache.get(Cache_utils.key_prefix + name)
+
+    @staticmethod
+    def bump_version(name):
+        version = str(uuid.uuid4())
+        cache.set(Cache_utils.key_prefix + name, version, timeout=0)
+        return version
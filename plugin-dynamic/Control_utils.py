@@ -0,0 +1,339 @@
+# coding=utf-8
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import docker
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from CTFd.cache import cache
+
+from .dbUtils import DBUtils
+from .Docker_utils import Docker_utils
+from .Frpc_utils import Frpc_utils
+from .Pool_utils import Pool_utils
+from .redisUtils import RedisUtils
+from .Spec_utils import Spec_utils
+from .State_utils import State_utils
+
+
+class Control_utils(object):
+    # 容器的创建/删除流程, 供 HTTP 路由和后台任务队列共同使用
+    # 返回 (success, msg)
+
+    @staticmethod
+    def _noop(msg):
+        pass
+
+    @staticmethod
+    def init_ports(force=True):
+        # 按配置的端口范围和数据库中仍在运行的容器重建共享端口池
+        plugin_configs = DBUtils.get_all_pluginconfigs()
+        min_port = plugin_configs.get("server_port_minimum")
+        max_port = plugin_configs.get("server_port_maximum")
+        if not min_port or not max_port:
+            return False
+        redis_util = RedisUtils(app=current_app)
+        # 先读认领记录再查数据库: 记录写入后才删除认领, 两次读取之间完成创建的端口至少出现在其中一处
+        used_ports = [c['port'] for c in redis_util.get_claims().values() if str(c.get('port')).isdigit()]
+        used_ports += list(DBUtils.get_used_ports())
+        return redis_util.init_redis_port_sets(min_port, max_port, used_ports, force=force)
+
+    @staticmethod
+    def add_container(user_id, challenge_id, progress=None):
+        progress = progress or Control_utils._noop
+        if DBUtils.get_container_by_user(user_id) != None:
+            return False, 'You have created a container. If you want to create a new container, first destroy the old container.'
+
+        spec = Spec_utils.get(challenge_id)
+        if spec == None:
+            return False, 'Challenge does not exist'
+
+        # 首先创建添加容器所需要的元素
+        plugin_configs = DBUtils.get_all_pluginconfigs()
+        container_network = plugin_configs.get("container_network")
+        uuid_code = uuid.uuid4()
+        container_name = str(user_id) + "-" + str(uuid_code)
+        docker_image = spec.docker_image
+        container_port = spec.redirect_port
+        mode = spec.redirect_type
+        api_adress = plugin_configs.get("frpc_api_ip")
+        api_port = plugin_configs.get("frpc_api_port")
+        timeout = int(plugin_configs.get("docker_timeout") or 3600)
+
+        redis_util = RedisUtils(app=current_app)
+        if mode == "digital_port":
+            remote_info = redis_util.get_available_port()
+            if remote_info == None:
+                return False, 'Running container reached upper limit'
+        elif mode == "dynamic_host":
+            remote_info = container_name
+        else:
+            return False, 'This mode does not exist'
+
+        # 数据库记录写入前崩溃时, 对账按这条记录判断容器的归属、端口和创建时间
+        # (认领的池容器没有用户/端口 label, Created 也是预热时间)
+        redis_util.set_claim(container_name, {
+            'user_id': user_id,
+            'challenge_id': challenge_id,
+            'rule': container_name,
+            'port': remote_info if mode == "digital_port" else None,
+            'claimed_at': time.time(),
+        })
+        try:
+            # 优先从预热池认领容器, 池为空时再冷启动
+            progress('Starting container')
+            container_ip = Pool_utils.claim(challenge_id, docker_image, container_network, container_name)
+            if container_ip == None:
+                Docker_utils.create_container(
+                    container_network=container_network, container_name=container_name, image_name=docker_image,
+                    labels={
+                        Docker_utils.USER_LABEL: str(user_id),
+                        Docker_utils.CHALLENGE_LABEL: str(challenge_id),
+                        Docker_utils.RULE_LABEL: container_name,
+                        Docker_utils.PORT_LABEL: str(remote_info),
+                    }
+                )
+        except Exception:
+            # 容器可能已经创建但没有启动成功
+            Control_utils._remove_docker_container(container_name)
+            if mode == "digital_port":
+                redis_util.add_available_port(remote_info)
+            redis_util.delete_claim(container_name)
+            raise
+        # 将启动的容器信息存入数据库ChallengeContainerV2
+        try:
+            DBUtils.create_new_container(user_id=user_id, challenge_id=challenge_id, uuid=uuid_code, remote_info=str(remote_info), timeout=timeout)
+        except IntegrityError:
+            # 同一用户的另一个请求先插入了记录 (或端口已被占用): 撤销刚启动的容器
+            Control_utils._remove_docker_container(container_name)
+            if mode == "digital_port" and DBUtils.get_container_by_port(remote_info) == None:
+                redis_util.add_available_port(remote_info)
+            return False, 'You have created a container. If you want to create a new container, first destroy the old container.'
+        finally:
+            redis_util.delete_claim(container_name)
+        try:
+            # 获取启动成功的容器IP
+            if container_ip == None:
+                container_ip = State_utils.get_ip(container_network, container_name)
+            # 设置Frp的映射规则
+            progress('Configuring proxy')
+            added = Frpc_utils.add_frpcRule(container_ip=container_ip, container_ip_port=str(container_port), remote_info=str(remote_info), mode=mode, rule_name=container_name, api_adress=api_adress, api_adress_port=str(api_port))
+        except Exception:
+            Control_utils._rollback(user_id, container_name, remote_info)
+            raise
+        if not added:
+            Control_utils._rollback(user_id, container_name, remote_info)
+            return False, 'Failed to configure the proxy rule'
+        return True, 'created'
+
+    @staticmethod
+    def _rollback(user_id, container_name, remote_info):
+        # 创建流程中途失败: 按创建的逆序撤销容器和数据库记录, 最后回收端口
+        Control_utils._remove_docker_container(container_name)
+        DBUtils.remove_current_container(user_id)
+        if str(remote_info).isdigit():
+            RedisUtils(app=current_app).add_available_port(remote_info)
+
+    @staticmethod
+    def remove_container(user_id, progress=None):
+        progress = progress or Control_utils._noop
+        challenge_info = DBUtils.get_container_by_user(user_id)
+        if challenge_info == None:
+            return False, 'Container has not been created by the current user'
+        remote_info = challenge_info.remote_info
+        # 删除当前用户创建的容器
+        progress('Removing container')
+        container_name = challenge_info.container_name
+        # 容器已经不存在时继续删除规则和记录
+        if not Control_utils._remove_docker_container(container_name):
+            return False, 'Failed to remove the container. Please try again later.'
+        # 删除当前用户创建的容器的映射规则
+        plugin_configs = DBUtils.get_all_pluginconfigs()
+        api_adress = plugin_configs.get("frpc_api_ip")
+        api_port = plugin_configs.get("frpc_api_port")
+        Frpc_utils.delete_frpcRule(rule_name=container_name, api_adress=api_adress, api_adress_port=api_port)
+        # 删除当前数据库中的数据
+        DBUtils.remove_current_container(user_id)
+        # 数据库记录删除后再回收端口, 避免端口在记录删除前被重新分配
+        if remote_info.isdigit():
+            RedisUtils(app=current_app).add_available_port(remote_info)
+        return True, 'deleted'
+
+    @staticmethod
+    def reset_container(user_id, challenge_id):
+        # 快速重置: 保留容器名、端口和 frpc 规则, 只在容器内完成重置
+        challenge_info = DBUtils.get_current_containers(user_id, challenge_id)
+        if challenge_info == None:
+            return False, 'Container has not been created by the current user'
+        spec = Spec_utils.get(challenge_id)
+        if spec == None:
+            return False, 'Challenge does not exist'
+        plugin_configs = DBUtils.get_all_pluginconfigs()
+        container_network = plugin_configs.get("container_network")
+        container_name = challenge_info.container_name
+        remote_info = challenge_info.remote_info
+        mode = plugin_configs.get("container_reset_mode") or 'recreate'
+
+        labels = {
+            Docker_utils.USER_LABEL: str(user_id),
+            Docker_utils.CHALLENGE_LABEL: str(challenge_id),
+            Docker_utils.RULE_LABEL: container_name,
+            Docker_utils.PORT_LABEL: str(remote_info),
+        }
+        try:
+            old_ip, new_ip = Docker_utils.reset_container(
+                container_name, container_network, spec.docker_image, mode=mode, labels=labels
+            )
+        except docker.errors.DockerException:
+            # 旧容器可能已被删除, 记录和规则保留, 用户可以再次重置或销毁
+            return False, 'Failed to reset the container. Please try again or destroy it.'
+        if old_ip != new_ip:
+            # 只有容器 IP 发生变化时才需要替换映射规则
+            rule = Frpc_utils.build_rule(new_ip, str(spec.redirect_port), str(remote_info), spec.redirect_type, container_name)
+            result = Frpc_utils.apply_rules(
+                plugin_configs.get("frpc_api_ip"), plugin_configs.get("frpc_api_port"),
+                delete=[container_name], add={container_name: rule}
+            )
+            if not result[container_name]:
+                return False, 'Failed to update the proxy rule'
+        return True, 'reset'
+
+    @staticmethod
+    def renew_container(user_id, challenge_id):
+        plugin_configs = DBUtils.get_all_pluginconfigs()
+        max_renew_count = int(plugin_configs.get("docker_max_renew_count") or 5)
+        timeout = int(plugin_configs.get("docker_timeout") or 3600)
+        if DBUtils.get_current_containers(user_id, challenge_id) == None:
+            return False, 'Container has not been created by the current user'
+        if not DBUtils.renew_current_container(user_id, challenge_id, max_renew_count, timeout):
+            return False, 'Max renewal times exceed'
+        return True, 'renewed'
+
+    @staticmethod
+    def _remove_docker_container(container_name):
+        try:
+            Docker_utils.remove_container(container_name)
+        except docker.errors.NotFound:
+            pass
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def destroy_containers(containers, max_workers=8):
+        # 批量销毁, 返回 (成功数量, 失败数量)
+        result = (0, 0)
+        for step in Control_utils.iter_destroy_containers(containers, max_workers):
+            if step['phase'] == 'finished':
+                result = (step['succeeded'], step['failed'])
+        return result
+
+    @staticmethod
+    def iter_destroy_containers(containers, max_workers=8):
+        # 批量销毁: Docker 删除并行执行, frpc 规则合并为一次更新, 数据库记录一条语句删除
+        # 逐步产出进度, 供管理页面流式显示
+        items = [(c.id, c.container_name, c.remote_info) for c in containers]
+        total = len(items)
+        if not items:
+            yield {'phase': 'finished', 'total': 0, 'succeeded': 0, 'failed': 0}
+            return
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict((executor.submit(Control_utils._remove_docker_container, name), name) for _, name, _ in items)
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                yield {'phase': 'docker', 'total': total, 'done': len(results)}
+
+        plugin_configs = DBUtils.get_all_pluginconfigs()
+        Frpc_utils.apply_rules(plugin_configs.get("frpc_api_ip"), plugin_configs.get("frpc_api_port"), delete=[name for _, name, _ in items])
+        yield {'phase': 'proxy', 'total': total, 'done': total}
+
+        # 删除失败的容器保留数据库记录, 交给下一轮重试
+        removed = [item for item in items if results[item[1]]]
+        DBUtils.remove_containers([container_id for container_id, _, _ in removed])
+        redis_util = RedisUtils(app=current_app)
+        for _, _, remote_info in removed:
+            if remote_info and remote_info.isdigit():
+                redis_util.add_available_port(remote_info)
+        yield {'phase': 'finished', 'total': total, 'succeeded': len(removed), 'failed': total - len(removed)}
+
+    @staticmethod
+    def _reset_docker_container(args):
+        container_name, container_network, image_name, mode = args
+        try:
+            return Docker_utils.reset_container(container_name, container_network, image_name, mode=mode)
+        except Exception:
+            return None
+
+    @staticmethod
+    def iter_reset_containers(containers, max_workers=8):
+        # 批量重置: Docker 重置并行执行, IP 发生变化的规则合并为一次 frpc 更新
+        plugin_configs = DBUtils.get_all_pluginconfigs()
+        container_network = plugin_configs.get("container_network")
+        mode = plugin_configs.get("container_reset_mode") or 'recreate'
+        items = []
+        for c in containers:
+            spec = Spec_utils.get(c.challenge_id)
+            if spec is not None:
+                items.append((c.container_name, str(c.remote_info), spec))
+        total = len(items)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict(
+                (executor.submit(Control_utils._reset_docker_container, (name, container_network, spec.docker_image, mode)), name)
+                for name, _, spec in items
+            )
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                yield {'phase': 'docker', 'total': total, 'done': len(results)}
+
+        add = {}
+        failed = set(name for name, ips in results.items() if ips is None)
+        for name, remote_info, spec in items:
+            ips = results[name]
+            if ips is not None and ips[0] != ips[1]:
+                rule = Frpc_utils.build_rule(ips[1], str(spec.redirect_port), remote_info, spec.redirect_type, name)
+                if rule is None:
+                    failed.add(name)
+                else:
+                    add[name] = rule
+        if add:
+            applied = Frpc_utils.apply_rules(
+                plugin_configs.get("frpc_api_ip"), plugin_configs.get("frpc_api_port"), delete=list(add), add=add
+            )
+            failed.update(name for name in add if not applied[name])
+        yield {'phase': 'proxy', 'total': total, 'done': total}
+        yield {'phase': 'finished', 'total': total, 'succeeded': total - len(failed), 'failed': len(failed)}
+
+    @staticmethod
+    def get_reaper_stats():
+        return cache.get('plugin_dynamic_reaper_stats') or {
+            'runs': 0, 'reaped_total': 0, 'failed_total': 0,
+            'last_run': None, 'last_reaped': 0, 'last_duration': 0,
+        }
+
+    @staticmethod
+    def auto_clean_container():
+        # 定时回收已过期 (expires_at) 的容器; 多个 worker 同时调度时只有拿到锁的执行
+        redis_util = RedisUtils(app=current_app)
+        if not redis_util.acquire_lock('reaper', 300):
+            return
+        try:
+            started = time.time()
+            expired = DBUtils.get_all_expired_container()
+            reaped, failed = Control_utils.destroy_containers(expired)
+
+            stats = Control_utils.get_reaper_stats()
+            stats['runs'] += 1
+            stats['reaped_total'] += reaped
+            stats['failed_total'] += failed
+            stats['last_run'] = int(started)
+            stats['last_reaped'] = reaped
+            stats['last_duration'] = round(time.time() - started, 3)
+            cache.set('plugin_dynamic_reaper_stats', stats, timeout=0)
+        finally:
+            redis_util.release_lock('reaper')
@@ -1,26 +1,194 @@
 # coding=utf-8
+import threading
+import time
+import uuid
+
 import docker
+import requests
+
 
 class Docker_utils(object):
+    # 进程内共享的 Docker 客户端
+    # 所有 Docker 操作复用同一个 DockerClient (底层 requests Session 自带连接池),
+    # 定期 ping 做健康检查, 连接断开时自动重建客户端
+    base_url = 'unix://var/run/docker.sock'
+    timeout = 60
+    health_check_interval = 30
+    POOL_LABEL = 'plugin-dynamic.pool'
+    # 插件创建的所有容器都带有 MANAGED_LABEL, 对账时按 label 过滤
+    MANAGED_LABEL = 'plugin-dynamic.managed'
+    USER_LABEL = 'plugin-dynamic.user'
+    CHALLENGE_LABEL = 'plugin-dynamic.challenge'
+    RULE_LABEL = 'plugin-dynamic.rule'
+    PORT_LABEL = 'plugin-dynamic.port'
+
+    _client = None
+    _last_check = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def configure(base_url=None, timeout=None):
+        with Docker_utils._lock:
+            base_url = base_url or Docker_utils.base_url
+            timeout = int(timeout) if timeout else Docker_utils.timeout
+            if base_url == Docker_utils.base_url and timeout == Docker_utils.timeout:
+                return
+            Docker_utils.base_url = base_url
+            Docker_utils.timeout = timeout
+            # 配置变化后丢弃旧客户端, 下次调用时按新配置重连
+            Docker_utils._reset()
+
+    @staticmethod
+    def _connect():
+        client = docker.DockerClient(base_url=Docker_utils.base_url, timeout=Docker_utils.timeout)
+        Docker_utils._last_check = time.time()
+        return client
+
+    @staticmethod
+    def _reset():
+        if Docker_utils._client is not None:
+            try:
+                Docker_utils._client.close()
+            except Exception:
+                pass
+        Docker_utils._client = None
+
+    @staticmethod
+    def get_client():
+        with Docker_utils._lock:
+            if Docker_utils._client is None:
+                Docker_utils._client = Docker_utils._connect()
+            elif time.time() - Docker_utils._last_check > Docker_utils.health_check_interval:
+                try:
+                    Docker_utils._client.ping()
+                    Docker_utils._last_check = time.time()
+                except (requests.exceptions.RequestException, docker.errors.APIError):
+                    Docker_utils._reset()
+                    Docker_utils._client = Docker_utils._connect()
+            return Docker_utils._client
+
+    @staticmethod
+    def _call(func, retry=True):
+        # 连接层异常时重建客户端; 只有幂等操作才重试一次
+        try:
+            return func(Docker_utils.get_client())
+        except requests.exceptions.ConnectionError:
+            with Docker_utils._lock:
+                Docker_utils._reset()
+            if not retry:
+                raise
+            return func(Docker_utils.get_client())
+
     # 创建并运行新的题目容器
     # 需要设置运行容器的网络 container_network , container_name , image_name
     #
     @staticmethod
-    def create_container(container_network, container_name, image_name):
-        client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-        client.containers.run(image_name, network=container_network, detach=True, name=container_name)
+    def create_container(container_network, container_name, image_name, labels=None):
+        labels = dict(labels or {})
+        labels[Docker_utils.MANAGED_LABEL] = '1'
+        Docker_utils._call(
+            lambda client: client.containers.run(image_name, network=container_network, detach=True, name=container_name, labels=labels),
+            retry=False
+        )
 
     @staticmethod
     def remove_container(container_name):
-        client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-        container = client.containers.get(container_name)
-        container.remove(force=True)
+        Docker_utils._call(lambda client: client.containers.get(container_name).remove(force=True))
 
     @staticmethod
     def getIPAdress_container(container_network, container_name):
-        client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-        container = client.containers.get(container_name)
-        container.reload()
+        # containers.get 返回的已经是最新的 inspect 结果, 无需再 reload
+        container = Docker_utils._call(lambda client: client.containers.get(container_name))
         return container.attrs['NetworkSettings']['Networks'][container_network]['IPAddress']
 
+    @staticmethod
+    def create_pool_container(container_network, challenge_id, image_name):
+        # 预热池中的空闲容器, 通过 label 标记所属题目, 认领时再重命名为 <user_id>-<uuid>
+        container_name = 'pool-' + str(challenge_id) + '-' + str(uuid.uuid4())
+        Docker_utils._call(
+            lambda client: client.containers.run(
+                image_name, network=container_network, detach=True, name=container_name,
+                labels={
+                    Docker_utils.POOL_LABEL: str(challenge_id),
+                    Docker_utils.MANAGED_LABEL: '1',
+                    Docker_utils.CHALLENGE_LABEL: str(challenge_id),
+                }
+            ),
+            retry=False
+        )
+        return container_name
+
+    @staticmethod
+    def list_pool_containers():
+        return Docker_utils._call(
+            lambda client: client.containers.list(all=True, filters={'label': Docker_utils.POOL_LABEL})
+        )
+
+    @staticmethod
+    def list_managed_containers():
+        return Docker_utils._call(
+            lambda client: client.containers.list(all=True, filters={'label': Docker_utils.MANAGED_LABEL})
+        )
+
+    @staticmethod
+    def list_user_containers():
+        # 按 <user_id>-<uuid> 名称列出用户容器, 包括加入 MANAGED_LABEL 之前创建的旧容器
+        return Docker_utils._call(
+            lambda client: client.containers.list(all=True, filters={'name': '^/?[0-9]+-[0-9a-f]{8}-'})
+        )
+
+    @staticmethod
+    def rename_container(container_name, new_name):
+        # 重命名是原子的: 同一个池容器只会被一个请求认领成功
+        Docker_utils._call(lambda client: client.api.rename(container_name, new_name), retry=False)
+
+    @staticmethod
+    def reset_container(container_name, container_network, image_name, mode='recreate', labels=None):
+        # 原地重置容器, 保持容器名和 IP 不变, 因此不需要修改 frpc 规则
+        # restart: 一次 restart 调用, 不重置文件系统
+        # recreate: 以原镜像、原 IP 重新创建容器, 文件系统恢复初始状态
+        # 返回 (旧 IP, 新 IP), 两者不同时调用方需要更新映射规则.
+        # 原容器已不存在时使用调用方给出的 labels 重新创建
+        client = Docker_utils.get_client()
+        if mode == 'restart':
+            try:
+                client.api.restart(container_name)
+                return None, None
+            except docker.errors.NotFound:
+                pass
+
+        try:
+            attrs = client.api.inspect_container(container_name)
+            old_ip = attrs['NetworkSettings']['Networks'].get(container_network, {}).get('IPAddress') or None
+            labels = attrs['Config'].get('Labels') or {}
+            client.api.remove_container(container_name, force=True)
+        except docker.errors.NotFound:
+            old_ip = None
+            labels = dict(labels or {})
+            labels[Docker_utils.MANAGED_LABEL] = '1'
+
+        def create(ip):
+            endpoint_config = client.api.create_endpoint_config(ipv4_address=ip) if ip else client.api.create_endpoint_config()
+            container = client.api.create_container(
+                image_name, name=container_name, labels=labels,
+                host_config=client.api.create_host_config(network_mode=container_network),
+                networking_config=client.api.create_networking_config({container_network: endpoint_config})
+            )
+            client.api.start(container['Id'])
 
+        try:
+            create(old_ip)
+            new_ip = old_ip
+        except docker.errors.APIError:
+            if old_ip is None:
+                raise
+            # 网络未配置子网或原 IP 已被占用, 退化为自动分配 IP
+            try:
+                client.api.remove_container(container_name, force=True)
+            except docker.errors.NotFound:
+                pass
+            create(None)
+            new_ip = None
+        if new_ip is None:
+            new_ip = Docker_utils.getIPAdress_container(container_network, container_name)
+        return old_ip, new_ip
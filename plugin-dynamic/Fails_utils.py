@@ -0,0 +1,175 @@
+# coding=utf-8
+import atexit
+import collections
+import datetime
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from CTFd.models import Fails, db
+
+
+class Fails_utils(object):
+    # 错误提交 (Fails) 的写后缓冲
+    # fail() 只把记录追加到内存缓冲和本地 spool 文件, 缓冲达到 max_rows 条或每隔 interval 秒
+    # 用一条多行 INSERT 写入数据库. spool 文件持有排他锁, 进程崩溃后由其他进程加锁并补写.
+    # pending_count() 给出本进程中尚未写入数据库的条数, 供尝试次数限制使用.
+    # 其他进程遗留的 spool 文件由刷新线程在自己的 app context 中补写
+    app = None
+    name = 'plugin-dynamic'
+    enabled = False
+    max_rows = 100
+    interval = 1.0
+    spool_dir = None
+
+    _rows = []
+    _pending = collections.Counter()
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _spool = None
+    _recovered = False
+    _thread = None
+
+    @staticmethod
+    def init_app(app, name, enabled=False, max_rows=None, interval=None, spool_dir=None):
+        Fails_utils.app = app
+        Fails_utils.name = name
+        Fails_utils.spool_dir = spool_dir or os.path.join(
+            app.config.get('LOG_FOLDER') or tempfile.gettempdir(), name + '-fails'
+        )
+        Fails_utils.configure(enabled, max_rows, interval)
+        atexit.register(Fails_utils._flush_job)
+
+    @staticmethod
+    def configure(enabled=False, max_rows=None, interval=None):
+        if max_rows:
+            Fails_utils.max_rows = int(max_rows)
+        if interval:
+            Fails_utils.interval = float(interval)
+        enabled = enabled in (True, 'true', 'True', '1', 1)
+        if enabled and Fails_utils._spool is None:
+            if not os.path.isdir(Fails_utils.spool_dir):
+                os.makedirs(Fails_utils.spool_dir)
+            path = os.path.join(Fails_utils.spool_dir, '{0}-{1}.jsonl'.format(os.getpid(), uuid.uuid4()))
+            Fails_utils._spool = open(path, 'a+')
+            fcntl.flock(Fails_utils._spool, fcntl.LOCK_EX)
+        if enabled and (Fails_utils._thread is None or not Fails_utils._thread.is_alive()):
+            Fails_utils._thread = threading.Thread(target=Fails_utils._run, name=Fails_utils.name + '-fails')
+            Fails_utils._thread.daemon = True
+            Fails_utils._thread.start()
+        Fails_utils.enabled = enabled
+
+    @staticmethod
+    def add(user_id, team_id, challenge_id, ip, provided):
+        row = {
+            'user_id': user_id,
+            'team_id': team_id,
+            'challenge_id': challenge_id,
+            'ip': ip,
+            'provided': provided,
+            'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f'),
+        }
+        with Fails_utils._lock:
+            Fails_utils._rows.append(row)
+            Fails_utils._pending[(team_id or user_id, challenge_id)] += 1
+            Fails_utils._spool.write(json.dumps(row) + '\n')
+            Fails_utils._spool.flush()
+            full = len(Fails_utils._rows) >= Fails_utils.max_rows
+        if full:
+            try:
+                Fails_utils.flush()
+            except Exception:
+                # 写入失败的记录已放回缓冲, 由后台线程重试, 不影响本次提交的响应
+                pass
+
+    @staticmethod
+    def pending_count(account_id, challenge_id):
+        with Fails_utils._lock:
+            return Fails_utils._pending.get((account_id, challenge_id), 0)
+
+    @staticmethod
+    def _insert(rows):
+        records = []
+        for row in rows:
+            record = dict(row)
+            record['type'] = 'incorrect'
+            record['date'] = datetime.datetime.strptime(row['date'], '%Y-%m-%dT%H:%M:%S.%f')
+            records.append(record)
+        db.session.execute(Fails.__table__.insert(), records)
+        db.session.commit()
+
+    @staticmethod
+    def flush():
+        with Fails_utils._flush_lock:
+            with Fails_utils._lock:
+                rows = Fails_utils._rows
+                Fails_utils._rows = []
+            if not rows:
+                return
+            try:
+                Fails_utils._insert(rows)
+            except Exception:
+                db.session.rollback()
+                with Fails_utils._lock:
+                    Fails_utils._rows = rows + Fails_utils._rows
+                raise
+            with Fails_utils._lock:
+                for row in rows:
+                    key = (row['team_id'] or row['user_id'], row['challenge_id'])
+                    Fails_utils._pending[key] -= 1
+                    if Fails_utils._pending[key] <= 0:
+                        del Fails_utils._pending[key]
+                # 已写入数据库的记录从 spool 中去掉, 只保留期间新加入的记录
+                Fails_utils._spool.seek(0)
+                Fails_utils._spool.truncate()
+                for row in Fails_utils._rows:
+                    Fails_utils._spool.write(json.dumps(row) + '\n')
+                Fails_utils._spool.flush()
+
+    @staticmethod
+    def _recover():
+        # 补写已退出进程遗留的 spool 文件; 仍在运行的进程持有文件锁, 会被跳过
+        for path in glob.glob(os.path.join(Fails_utils.spool_dir, '*.jsonl')):
+            if path == Fails_utils._spool.name:
+                continue
+            with open(path, 'r') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    continue
+                rows = [json.loads(line) for line in f if line.strip()]
+                if rows:
+                    Fails_utils._insert(rows)
+                os.remove(path)
+
+    @staticmethod
+    def _flush_job():
+        if Fails_utils.app is None or Fails_utils._spool is None:
+            return
+        with Fails_utils.app.app_context():
+            try:
+                if not Fails_utils._recovered:
+                    # 补写失败时不影响本进程的缓冲写入, 下一轮重试
+                    try:
+                        Fails_utils._recover()
+                        Fails_utils._recovered = True
+                    except Exception:
+                        db.session.rollback()
+                Fails_utils.flush()
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def _run():
+        while True:
+            time.sleep(Fails_utils.interval)
+            try:
+                Fails_utils._flush_job()
+            except Exception:
+                # 数据库暂时不可用时保留缓冲, 下一轮重试
+                pass
@@ -1,110 +1,324 @@
 # coding=utf-8
+import collections
+import threading
+import time
+
 import requests
 
-# mode = digital_port/dynamic_host
-class Frpc_utils(object):
+from .redisUtils import RedisUtils
+
 
+class Frpc_config(object):
+    # frpc.ini 的内存模型
+    # 按 section 名索引 (O(1) 查找/增删), 同时维护 remote_port / subdomain 的反向索引,
+    # 每个 section 的文本单独缓存, 序列化时直接拼接.
+    # 给出 base (上一次推送的模型) 时, 文本与 base 中相同的 section 直接复用 base 的解析结果, 只解析有变化的 section
+
+    def __init__(self, text='', base=None):
+        self.preamble = []
+        self.sections = collections.OrderedDict()
+        self.remote_ports = {}
+        self.subdomains = {}
+        # name -> (remote_port, subdomain)
+        self.keys = {}
+        self._rendered = {}
+        self._base = base
+        self.text = text
+        name = None
+        lines = []
+        for line in text.split('\n'):
+            stripped = line.strip()
+            if stripped.startswith('[') and stripped.endswith(']'):
+                self._store(name, lines)
+                name = stripped[1:-1].strip()
+                lines = []
+            else:
+                lines.append(line)
+        self._store(name, lines)
+        self._base = None
 
     @staticmethod
-    def add_frpcRule(container_ip, container_ip_port, remote_info, mode, rule_name, api_adress, api_adress_port):
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.132 Safari/537.36',
-            'Accept': '*/*',
-            'Accept-Encoding': 'gzip, deflate',
-            'Accept-Language': 'zh-CN,zh;q=0.9',
-            'Connection': 'close'
-        }
-        api_url = 'http://' + api_adress + ':' + api_adress_port
-        api_url_config = api_url + '/api/config'
-        api_url_reload = api_url + '/api/reload'
-        # get old  FrpcRule
-        request_frpc_rule = requests.request('get', url=api_url_config, headers=headers).text
-        # str to list
-        frpc_rule_list = request_frpc_rule.split('\n')
-        # print frpcRule_list
+    def _options(lines):
+        options = {}
+        for line in lines:
+            key, sep, value = line.partition('=')
+            if sep:
+                options[key.strip()] = value.strip()
+        return options
+
+    def _store(self, name, lines):
+        if name is None:
+            self.preamble = lines
+            return
+        if name in self.sections:
+            # 重复的 section 以后出现的为准, 与 frpc 的解析行为一致
+            self.remove(name)
+        base = self._base
+        rendered = base._rendered.get(name) if base is not None and name in base.sections else None
+        if rendered is not None and rendered == '\n'.join(['[' + name + ']'] + lines):
+            # 与上一次推送的内容相同, 复用其配置行和索引键
+            lines = base.sections[name]
+            remote_port, subdomain = base.keys[name]
+            self._rendered[name] = rendered
+        else:
+            options = Frpc_config._options(lines)
+            remote_port, subdomain = options.get('remote_port'), options.get('subdomain')
+        self.sections[name] = lines
+        self.keys[name] = (remote_port, subdomain)
+        if remote_port is not None:
+            self.remote_ports[remote_port] = name
+        if subdomain is not None:
+            self.subdomains[subdomain] = name
+
+    def has(self, name):
+        return name in self.sections
+
+    def conflicts(self, lines):
+        # 新规则的 remote_port/subdomain 是否已被其他 section 占用
+        options = Frpc_config._options(lines)
+        return options.get('remote_port') in self.remote_ports or options.get('subdomain') in self.subdomains
 
-        # list to str
-        # print '\n'.join(frpcRule_list)
+    def add(self, name, lines):
+        if name in self.sections or self.conflicts(lines):
+            return False
+        self._store(name, list(lines))
+        return True
 
-        if len(frpc_rule_list) == 0:
+    def remove(self, name):
+        lines = self.sections.pop(name, None)
+        if lines is None:
             return False
+        self._rendered.pop(name, None)
+        remote_port, subdomain = self.keys.pop(name)
+        if self.remote_ports.get(remote_port) == name:
+            del self.remote_ports[remote_port]
+        if self.subdomains.get(subdomain) == name:
+            del self.subdomains[subdomain]
+        return True
+
+    def _render(self, name):
+        text = self._rendered.get(name)
+        if text is None:
+            text = '\n'.join(['[' + name + ']'] + self.sections[name])
+            self._rendered[name] = text
+        return text
+
+    def to_text(self):
+        parts = ['\n'.join(self.preamble)] if self.preamble else []
+        parts.extend(self._render(name) for name in self.sections)
+        return '\n'.join(parts)
+
+    def copy(self):
+        # 浅拷贝: 各 section 的配置行列表不会被原地修改, 可以共享
+        other = Frpc_config.__new__(Frpc_config)
+        other.preamble = list(self.preamble)
+        other.sections = collections.OrderedDict(self.sections)
+        other.remote_ports = dict(self.remote_ports)
+        other.subdomains = dict(self.subdomains)
+        other.keys = dict(self.keys)
+        other._base = None
+        other._rendered = dict(self._rendered)
+        other.text = self.text
+        return other
+
+
+# mode = digital_port/dynamic_host
+class Frpc_utils(object):
+    # frpc 规则管理
+    # add/delete 只提交修改意图, 由后台线程把 batch_window 秒内到达的所有意图合并成
+    # 一次 GET /api/config + 一次 PUT + 一次 /api/reload, 再把每条规则的结果返回给调用方
+    app = None
+
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.132 Safari/537.36',
+        'Accept': '*/*',
+        'Accept-Encoding': 'gzip, deflate',
+        'Accept-Language': 'zh-CN,zh;q=0.9',
+        'Connection': 'close'
+    }
+    batch_window = 0.05
+    # 每个 frpc API 请求的超时; 一个批次最多 3 个请求, 等待 wait_timeout 后仍未被后台线程取走的意图会被取消
+    http_timeout = 10
+    wait_timeout = 30
+    # 跨 worker 的配置锁, 覆盖一个批次的 3 个请求
+    lock_timeout = 40
 
-        # create new FrpcRule
+    _intents = []
+    _cond = threading.Condition()
+    _worker = None
+    # api_url -> 最近一次成功推送的 Frpc_config
+    _pushed = {}
+
+    @staticmethod
+    def init_app(app):
+        Frpc_utils.app = app
+
+    @staticmethod
+    def build_rule(container_ip, container_ip_port, remote_info, mode, rule_name):
+        # create new FrpcRule, 返回 [rule_name] 之下的配置行
         if mode == 'digital_port':
             if not remote_info.isdigit():
-                return False
-            rule_template = [
-                '[' + rule_name + ']',
+                return None
+            return [
                 'type = tcp',
                 'local_ip = ' + container_ip,
                 'local_port = ' + container_ip_port,
                 'remote_port = ' + remote_info
             ]
-            # print rule_template
-            frpc_rule_list.extend(rule_template)
-            data = '\n'.join(frpc_rule_list)
-            r_1 = requests.put(url=api_url_config, data=data, headers=headers).status_code
-            r_2 = requests.get(url=api_url_reload, headers=headers).status_code
-            if r_1 == 200 and r_2 == 200:
-                return True
-            elif r_2 == 400:
-                return False
-            else:
-                return False
         elif mode == 'dynamic_host':
             if remote_info.isdigit():
-                return False
+                return None
             if container_ip_port == '80':
                 method = 'http'
             elif container_ip_port == '443':
                 method = 'https'
             else:
                 method = 'http'
-            rule_template = [
-                '[' + rule_name + ']',
+            return [
                 'type = ' + method,
                 'local_ip = ' + container_ip,
                 'local_port = ' + container_ip_port,
                 'subdomain = ' + remote_info
             ]
-            # print rule_template
-            frpc_rule_list.extend(rule_template)
-            data = '\n'.join(frpc_rule_list)
-            r_1 = requests.put(url=api_url_config, data=data, headers=headers).status_code
-            r_2 = requests.get(url=api_url_reload, headers=headers).status_code
-            if r_1 == 200 and r_2 == 200:
-                return True
-            elif r_2 == 400:
-                return False
-            else:
-                return False
-        else:
+        return None
+
+    @staticmethod
+    def add_frpcRule(container_ip, container_ip_port, remote_info, mode, rule_name, api_adress, api_adress_port):
+        rule = Frpc_utils.build_rule(container_ip, container_ip_port, remote_info, mode, rule_name)
+        if rule is None:
             return False
+        return Frpc_utils.apply_rules(api_adress, api_adress_port, add={rule_name: rule})[rule_name]
 
     @staticmethod
     def delete_frpcRule(rule_name, api_adress, api_adress_port):
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.132 Safari/537.36',
-            'Accept': '*/*',
-            'Accept-Encoding': 'gzip, deflate',
-            'Accept-Language': 'zh-CN,zh;q=0.9',
-            'Connection': 'close'
-        }
-        api_url = 'http://' + api_adress + ':' + api_adress_port
+        return Frpc_utils.apply_rules(api_adress, api_adress_port, delete=[rule_name])[rule_name]
+
+    @staticmethod
+    def get_rule_names(api_adress, api_adress_port):
+        api_url = 'http://' + str(api_adress) + ':' + str(api_adress_port)
+        return list(Frpc_utils._load_config(api_url).sections.keys())
+
+    @staticmethod
+    def apply_rules(api_adress, api_adress_port, add=None, delete=None):
+        # 提交一组规则修改并等待所在批次完成, 返回 {rule_name: bool}
+        api_url = 'http://' + str(api_adress) + ':' + str(api_adress_port)
+        intents = []
+        for rule_name in (delete or []):
+            intents.append({'api_url': api_url, 'action': 'delete', 'rule_name': rule_name, 'rule': None})
+        for rule_name, rule in (add or {}).items():
+            intents.append({'api_url': api_url, 'action': 'add', 'rule_name': rule_name, 'rule': rule})
+        for intent in intents:
+            intent['event'] = threading.Event()
+            intent['result'] = False
+
+        with Frpc_utils._cond:
+            Frpc_utils._intents.extend(intents)
+            if Frpc_utils._worker is None or not Frpc_utils._worker.is_alive():
+                Frpc_utils._worker = threading.Thread(target=Frpc_utils._run, name='plugin-dynamic-frpc')
+                Frpc_utils._worker.daemon = True
+                Frpc_utils._worker.start()
+            Frpc_utils._cond.notify()
+
+        results = {}
+        for intent in intents:
+            if not intent['event'].wait(Frpc_utils.wait_timeout):
+                with Frpc_utils._cond:
+                    if not intent.get('taken'):
+                        # 尚未被后台线程取走: 取消, 调用方按失败回滚时不会再被晚到的修改覆盖
+                        intent['cancelled'] = True
+                if not intent.get('cancelled'):
+                    # 已在处理中: 所有请求都有超时, 等待本批次结束以得到确定的结果
+                    intent['event'].wait()
+            results[intent['rule_name']] = intent['result']
+        return results
+
+    @staticmethod
+    def _run():
+        while True:
+            with Frpc_utils._cond:
+                while not Frpc_utils._intents:
+                    Frpc_utils._cond.wait()
+            # 等待一个合并窗口, 收集同一时间段内的其他修改
+            time.sleep(Frpc_utils.batch_window)
+            with Frpc_utils._cond:
+                intents = [intent for intent in Frpc_utils._intents if not intent.get('cancelled')]
+                Frpc_utils._intents = []
+                for intent in intents:
+                    intent['taken'] = True
+
+            batches = {}
+            for intent in intents:
+                batches.setdefault(intent['api_url'], []).append(intent)
+            for api_url, batch in batches.items():
+                try:
+                    Frpc_utils._flush(api_url, batch)
+                except Exception:
+                    for intent in batch:
+                        intent['result'] = False
+                finally:
+                    for intent in batch:
+                        intent['event'].set()
+
+    @staticmethod
+    def _load_config(api_url):
+        # get old  FrpcRule
+        text = requests.request('get', url=api_url + '/api/config', headers=Frpc_utils.headers, timeout=Frpc_utils.http_timeout).text
+        pushed = Frpc_utils._pushed.get(api_url)
+        if pushed is not None and pushed.text == text:
+            # 配置未被外部修改, 复用上一次推送时解析好的模型; 返回副本, 推送失败时缓存保持不变
+            return pushed.copy()
+        # 被外部 (或其他 worker) 修改过: 与上一次推送的模型逐 section 比较, 只解析变化的部分
+        return Frpc_config(text, base=pushed)
+
+    @staticmethod
+    def _flush(api_url, batch):
+        # 后台线程只合并本进程的修改, 多个 worker 之间用 Redis 锁串行化 GET -> PUT -> reload,
+        # 避免一个 worker 用旧配置覆盖另一个 worker 刚写入的规则
+        redis_util = RedisUtils(app=Frpc_utils.app)
+        lock_name = 'frpc:' + api_url
+        deadline = time.time() + Frpc_utils.lock_timeout
+        while not redis_util.acquire_lock(lock_name, Frpc_utils.lock_timeout):
+            if time.time() > deadline:
+                raise RuntimeError('Timed out waiting for the frpc config lock')
+            time.sleep(Frpc_utils.batch_window)
+        try:
+            Frpc_utils._apply(api_url, batch)
+        finally:
+            redis_util.release_lock(lock_name)
+
+    @staticmethod
+    def _apply(api_url, batch):
         api_url_config = api_url + '/api/config'
         api_url_reload = api_url + '/api/reload'
-        # get old  FrpcRule
-        request_frpc_rule = requests.request('get', url=api_url_config, headers=headers).text
-        # str to list
-        frpc_rule_list = request_frpc_rule.split('\n')
-        index = frpc_rule_list.index('[' + rule_name + ']')
-        del frpc_rule_list[index:index+5]
-        data = '\n'.join(frpc_rule_list)
-        r_1 = requests.put(url=api_url_config, data=data, headers=headers).status_code
-        r_2 = requests.get(url=api_url_reload, headers=headers).status_code
-        if r_1 == 200 and r_2 == 200:
-            return True
-        elif r_2 == 400:
-            return False
-        else:
-            return False
\ No newline at end of file
+        config = Frpc_utils._load_config(api_url)
+
+        changed = []
+        for intent in batch:
+            if intent['action'] == 'delete':
+                applied = config.remove(intent['rule_name'])
+            else:
+                # 同名规则或端口/子域名已被占用时不覆盖其他容器的规则
+                applied = config.add(intent['rule_name'], intent['rule'])
+            if applied:
+                changed.append(intent)
+
+        if not changed:
+            return
+
+        data = config.to_text()
+        try:
+            r_1 = requests.put(url=api_url_config, data=data, headers=Frpc_utils.headers, timeout=Frpc_utils.http_timeout).status_code
+        except Exception:
+            # PUT 是否生效未知, 下一次重新解析服务端的配置
+            Frpc_utils._pushed.pop(api_url, None)
+            raise
+        if r_1 != 200:
+            Frpc_utils._pushed.pop(api_url, None)
+            return
+        config.text = data
+        Frpc_utils._pushed[api_url] = config
+        r_2 = requests.get(url=api_url_reload, headers=Frpc_utils.headers, timeout=Frpc_utils.http_timeout).status_code
+        if r_2 != 200:
+            return
+        for intent in changed:
+            intent['result'] = True
@@ -0,0 +1,87 @@
+# coding=utf-8
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from CTFd.cache import cache
+from CTFd.models import db
+
+
+class Job_utils(object):
+    # 后台容器任务队列
+    # HTTP 请求只负责投递任务并立即返回 job_id, 由线程池完成 docker/frpc/数据库操作
+    # 任务状态写入 CTFd 的缓存 (生产环境为 Redis), 任意 web worker 都可以查询
+    app = None
+    executor = None
+    max_workers = 4
+    status_timeout = 600
+
+    _pending = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def init_app(app, max_workers=None):
+        Job_utils.app = app
+        Job_utils.configure(max_workers)
+
+    @staticmethod
+    def configure(max_workers=None):
+        max_workers = int(max_workers) if max_workers else Job_utils.max_workers
+        if Job_utils.executor is not None and max_workers == Job_utils.max_workers:
+            return
+        Job_utils.max_workers = max_workers
+        old_executor = Job_utils.executor
+        Job_utils.executor = ThreadPoolExecutor(max_workers=Job_utils.max_workers)
+        if old_executor is not None:
+            # 已投递的任务继续在旧线程池中执行完毕
+            old_executor.shutdown(wait=False)
+
+    @staticmethod
+    def _key(job_id):
+        return "plugin_dynamic_job_" + str(job_id)
+
+    @staticmethod
+    def _set_status(job_id, user_id, status, msg=''):
+        cache.set(Job_utils._key(job_id), {
+            'job_id': job_id,
+            'user_id': user_id,
+            'status': status,
+            'msg': msg,
+        }, timeout=Job_utils.status_timeout)
+
+    @staticmethod
+    def get_status(job_id):
+        return cache.get(Job_utils._key(job_id))
+
+    @staticmethod
+    def submit(user_id, func, *args):
+        # 同一用户同时只允许一个进行中的任务, 重复点击返回同一个 job_id
+        with Job_utils._lock:
+            if user_id in Job_utils._pending:
+                return Job_utils._pending[user_id]
+            job_id = str(uuid.uuid4())
+            Job_utils._pending[user_id] = job_id
+
+        Job_utils._set_status(job_id, user_id, 'queued')
+        Job_utils.executor.submit(Job_utils._run, job_id, user_id, func, args)
+        return job_id
+
+    @staticmethod
+    def _run(job_id, user_id, func, args):
+        def progress(msg):
+            Job_utils._set_status(job_id, user_id, 'running', msg)
+
+        try:
+            with Job_utils.app.app_context():
+                try:
+                    progress('Running')
+                    result, msg = func(*args, progress=progress)
+                    Job_utils._set_status(job_id, user_id, 'success' if result else 'failed', msg)
+                except Exception as e:
+                    db.session.rollback()
+                    Job_utils._set_status(job_id, user_id, 'failed', 'Failed to provision the container: ' + str(e))
+                finally:
+                    db.session.remove()
+        finally:
+            with Job_utils._lock:
+                Job_utils._pending.pop(user_id, None)
@@ -0,0 +1,113 @@
+# coding=utf-8
+import collections
+import threading
+import time
+import uuid
+
+from .redisUtils import RedisUtils
+
+
+class Limit_utils(object):
+    # 提交频率限制 (滑动窗口日志)
+    # 按 (用户, 题目) 和 (队伍, 题目) 统计 window 秒内的提交次数, 超过 limit 次的提交在查询 Flags、
+    # 写入 Fails 之前直接拒绝. 默认在进程内计数, 选择 redis 后端时使用有序集合在所有 worker 间共享.
+    # 被拒绝的提交按 (用户, 队伍, 题目) 累计, 供管理员查看是谁在爆破哪道题
+    limit = 0
+    window = 60
+    backend = 'memory'
+    redis_client = None
+
+    _hits = {}
+    _offenders = collections.Counter()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def init_app(app):
+        Limit_utils.redis_client = RedisUtils(app=app).redis_client
+
+    @staticmethod
+    def configure(limit=None, window=None, backend=None):
+        Limit_utils.limit = int(limit) if limit else 0
+        Limit_utils.window = int(window) if window else 60
+        Limit_utils.backend = 'redis' if backend == 'redis' and Limit_utils.redis_client is not None else 'memory'
+
+    @staticmethod
+    def allow(user_id, team_id, challenge_id):
+        if Limit_utils.limit <= 0:
+            return True
+        keys = ['u:{0}:{1}'.format(user_id, challenge_id)]
+        if team_id:
+            keys.append('t:{0}:{1}'.format(team_id, challenge_id))
+
+        now = time.time()
+        if Limit_utils.backend == 'redis':
+            counts = Limit_utils._hit_redis(keys, now)
+        else:
+            counts = Limit_utils._hit_memory(keys, now)
+        if max(counts) <= Limit_utils.limit:
+            return True
+
+        offender = '{0}:{1}:{2}'.format(user_id, team_id or '', challenge_id)
+        if Limit_utils.backend == 'redis':
+            Limit_utils.redis_client.zincrby(RedisUtils.key_prefix + ':offenders', 1, offender)
+        else:
+            with Limit_utils._lock:
+                Limit_utils._offenders[offender] += 1
+        return False
+
+    @staticmethod
+    def _hit_memory(keys, now):
+        counts = []
+        with Limit_utils._lock:
+            for key in keys:
+                hits = Limit_utils._hits.get(key)
+                if hits is None:
+                    hits = Limit_utils._hits[key] = collections.deque()
+                while hits and hits[0] <= now - Limit_utils.window:
+                    hits.popleft()
+                hits.append(now)
+                # 超出上限后的记录只需保留足够判断"仍在超限"的数量
+                while len(hits) > Limit_utils.limit + 1:
+                    hits.popleft()
+                counts.append(len(hits))
+            if len(Limit_utils._hits) > 100000:
+                # 清理窗口外不再活跃的键, 防止内存无限增长
+                for key in [k for k, v in Limit_utils._hits.items() if not v or v[-1] <= now - Limit_utils.window]:
+                    del Limit_utils._hits[key]
+        return counts
+
+    @staticmethod
+    def _hit_redis(keys, now):
+        pipe = Limit_utils.redis_client.pipeline()
+        for key in keys:
+            key = RedisUtils.key_prefix + ':submissions:' + key
+            pipe.zremrangebyscore(key, 0, now - Limit_utils.window)
+            pipe.zadd(key, {str(uuid.uuid4()): now})
+            pipe.zcard(key)
+            pipe.expire(key, Limit_utils.window)
+        results = pipe.execute()
+        return [results[i] for i in range(2, len(results), 4)]
+
+    @staticmethod
+    def get_offenders(count=50):
+        # 返回被拒绝次数最多的 (用户, 队伍, 题目)
+        if Limit_utils.backend == 'redis':
+            items = [
+                (member.decode('utf-8'), int(score))
+                for member, score in Limit_utils.redis_client.zrevrange(
+                    RedisUtils.key_prefix + ':offenders', 0, count - 1, withscores=True
+                )
+            ]
+        else:
+            with Limit_utils._lock:
+                items = Limit_utils._offenders.most_common(count)
+        offenders = []
+        for member, rejected in items:
+            user_id, team_id, challenge_id = member.split(':')
+            offenders.append({
+                'user_id': int(user_id),
+                'team_id': int(team_id) if team_id else None,
+                'challenge_id': int(challenge_id),
+                'rejected': rejected,
+            })
+        return offenders
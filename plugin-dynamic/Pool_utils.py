@@ -0,0 +1,124 @@
+# coding=utf-8
+import collections
+import threading
+
+import docker
+
+from CTFd.models import db
+
+from .Docker_utils import Docker_utils
+from .redisUtils import RedisUtils
+
+
+class Pool_utils(object):
+    # 每道 plugin-dynamic 题目的预热容器池
+    # 后台任务提前在 container_network 上启动 target_size 个空闲容器并记录其 IP,
+    # 用户启动实例时直接认领 (重命名) 一个空闲容器, 只需再添加 frpc 规则和数据库记录
+    app = None
+    target_size = 0
+
+    # challenge_id -> deque((container_name, image, network, ip))
+    _pools = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def init_app(app, target_size=None):
+        Pool_utils.app = app
+        Pool_utils.configure(target_size)
+
+    @staticmethod
+    def configure(target_size=None):
+        try:
+            Pool_utils.target_size = max(int(target_size), 0)
+        except (TypeError, ValueError):
+            Pool_utils.target_size = 0
+
+    @staticmethod
+    def claim(challenge_id, image_name, container_network, container_name):
+        # 认领成功返回容器 IP, 池为空时返回 None 由调用方走冷启动流程
+        while True:
+            with Pool_utils._lock:
+                pool = Pool_utils._pools.get(int(challenge_id))
+                if not pool:
+                    return None
+                pool_name, image, network, ip = pool.popleft()
+            if image != image_name or network != container_network:
+                # 题目镜像或网络已修改, 旧的池容器交给下一次补充时清理
+                continue
+            try:
+                Docker_utils.rename_container(pool_name, container_name)
+            except docker.errors.APIError:
+                # 已被其他 worker 认领或容器已不存在
+                continue
+            return ip
+
+    @staticmethod
+    def refill(manage=True):
+        # manage=False 时只同步本进程的池列表, 不创建/删除容器
+        # 延迟导入, 避免与 __init__ 中的挑战模型循环引用
+        from . import DynamicChallengeExc
+        from .dbUtils import DBUtils
+
+        container_network = DBUtils.get_all_pluginconfigs().get("container_network")
+        challenges = {}
+        if Pool_utils.target_size > 0:
+            for c in DynamicChallengeExc.query.filter_by(state='visible').all():
+                challenges[c.id] = c.docker_image
+
+        # 以 Docker 中实际存在的池容器为准, 多个 worker 看到的是同一份数据
+        pools = collections.defaultdict(collections.deque)
+        for c in Docker_utils.list_pool_containers():
+            if not c.name.startswith('pool-'):
+                # 已被认领的容器
+                continue
+            challenge_id = int(c.labels.get(Docker_utils.POOL_LABEL, 0))
+            image = c.attrs['Config']['Image']
+            networks = c.attrs['NetworkSettings']['Networks']
+            stale = (
+                c.status != 'running'
+                or challenges.get(challenge_id) != image
+                or container_network not in networks
+                or len(pools[challenge_id]) >= Pool_utils.target_size
+            )
+            if stale:
+                if manage:
+                    try:
+                        c.remove(force=True)
+                    except docker.errors.APIError:
+                        pass
+                continue
+            pools[challenge_id].append((c.name, image, container_network, networks[container_network]['IPAddress']))
+
+        for challenge_id, image in (challenges.items() if manage else []):
+            pool = pools[challenge_id]
+            try:
+                while len(pool) < Pool_utils.target_size:
+                    container_name = Docker_utils.create_pool_container(container_network, challenge_id, image)
+                    ip = Docker_utils.getIPAdress_container(container_network, container_name)
+                    pool.append((container_name, image, container_network, ip))
+            except docker.errors.DockerException:
+                # 某个镜像启动失败不影响其他题目的补充
+                continue
+
+        with Pool_utils._lock:
+            Pool_utils._pools = dict(pools)
+
+    @staticmethod
+    def refill_job():
+        # 多个 worker 都会调度该任务, 同一时刻只允许一个 worker 补充
+        redis_util = RedisUtils(app=Pool_utils.app)
+        if not redis_util.acquire_lock('pool-refill', 300):
+            with Pool_utils.app.app_context():
+                try:
+                    Pool_utils.refill(manage=False)
+                finally:
+                    db.session.remove()
+            return
+        try:
+            with Pool_utils.app.app_context():
+                try:
+                    Pool_utils.refill()
+                finally:
+                    db.session.remove()
+        finally:
+            redis_util.release_lock('pool-refill')
@@ -0,0 +1,180 @@
+# coding=utf-8
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from CTFd.cache import cache
+from CTFd.models import db
+
+from .Control_utils import Control_utils
+from .dbUtils import DBUtils
+from .Docker_utils import Docker_utils
+from .Frpc_utils import Frpc_utils
+from .redisUtils import RedisUtils
+from .Spec_utils import Spec_utils
+from .State_utils import State_utils
+
+
+class Reconcile_utils(object):
+    # Docker 容器、frpc 规则、ChallengeContainerV2 记录三方对账
+    # 每个来源只列出一次 (Docker 按 MANAGED_LABEL 过滤, frpc 只看 <user_id>-<uuid> 形式的 section),
+    # 用集合运算得出差异后一次性修复: 并行删除孤儿容器, 合并为一次 frpc 更新, 一条 DELETE 删除孤儿记录.
+    # 没有 MANAGED_LABEL 的旧容器按名称列出, 只用于保护它们的记录和规则, 不会被当作孤儿删除.
+    # 还没有数据库记录的容器以 Control_utils 写入的认领记录为准: 年龄从认领时间算起, 端口取认领记录中的端口.
+    # 创建不足 grace 秒的容器和记录可能还在创建流程中, 不处理
+    app = None
+    grace = 120
+    max_workers = 8
+    report_key = 'plugin_dynamic_reconcile_report'
+
+    @staticmethod
+    def init_app(app):
+        Reconcile_utils.app = app
+
+    @staticmethod
+    def configure(grace=None):
+        try:
+            Reconcile_utils.grace = max(int(grace), 0)
+        except (TypeError, ValueError):
+            Reconcile_utils.grace = 120
+        # 认领记录过期后按 Created 计算年龄, 此时容器一定已经超过 grace
+        RedisUtils.claim_timeout = max(900, Reconcile_utils.grace * 2)
+
+    @staticmethod
+    def _docker_age(created):
+        # Docker 返回 UTC 时间, 如 2026-10-18T10:00:00.123456789Z
+        created = datetime.datetime.strptime(created[:19], '%Y-%m-%dT%H:%M:%S')
+        return (datetime.datetime.utcnow() - created).total_seconds()
+
+    @staticmethod
+    def plan():
+        plugin_configs = DBUtils.get_all_pluginconfigs()
+        now = datetime.datetime.now()
+
+        claims = RedisUtils(app=Reconcile_utils.app).get_claims()
+        docker_ages = {}
+        docker_ports = {}
+        for c in Docker_utils.list_managed_containers():
+            if c.name.startswith('pool-'):
+                # 预热池容器由 Pool_utils 管理
+                continue
+            claim = claims.get(c.name)
+            if claim is not None:
+                # 认领的池容器只有 POOL/MANAGED/CHALLENGE label
+                docker_ages[c.name] = time.time() - claim['claimed_at']
+                docker_ports[c.name] = c.labels.get(Docker_utils.PORT_LABEL) or claim.get('port')
+            else:
+                docker_ages[c.name] = Reconcile_utils._docker_age(c.attrs['Created'])
+                docker_ports[c.name] = c.labels.get(Docker_utils.PORT_LABEL)
+        legacy = set(
+            c.name for c in Docker_utils.list_user_containers()
+            if c.name not in docker_ages and State_utils.NAME_PATTERN.match(c.name)
+        )
+        rules = set(
+            name for name in Frpc_utils.get_rule_names(plugin_configs.get("frpc_api_ip"), plugin_configs.get("frpc_api_port"))
+            if State_utils.NAME_PATTERN.match(name)
+        )
+        rows = dict(
+            (c.container_name, (c.id, c.user_id, c.challenge_id, c.remote_info, (now - c.start_time).total_seconds()))
+            for c in DBUtils.get_all_container()
+        )
+
+        docker_names = set(docker_ages) | legacy
+        row_names = set(rows)
+        old = lambda age: age > Reconcile_utils.grace
+        return {
+            # 有容器没有记录
+            'docker_orphans': dict(
+                (name, docker_ports[name]) for name in set(docker_ages) - row_names if old(docker_ages[name])
+            ),
+            # 有记录没有容器
+            'row_orphans': dict(
+                (name, rows[name]) for name in row_names - docker_names if old(rows[name][4])
+            ),
+            # 有规则没有记录; 容器还在创建中的跳过
+            'rule_orphans': sorted(
+                name for name in rules - row_names - legacy if name not in docker_ages or old(docker_ages[name])
+            ),
+            # 有记录有容器但没有规则
+            'missing_rules': dict(
+                (name, rows[name]) for name in (row_names & docker_names) - rules if old(rows[name][4])
+            ),
+            'rules': rules,
+        }
+
+    @staticmethod
+    def reconcile(dry_run=False):
+        started = time.time()
+        plan = Reconcile_utils.plan()
+        report = {
+            'docker_orphans': sorted(plan['docker_orphans']),
+            'row_orphans': sorted(plan['row_orphans']),
+            'rule_orphans': plan['rule_orphans'],
+            'missing_rules': sorted(plan['missing_rules']),
+            'dry_run': dry_run,
+        }
+        if dry_run:
+            return report
+
+        plugin_configs = DBUtils.get_all_pluginconfigs()
+        container_network = plugin_configs.get("container_network")
+        redis_util = RedisUtils(app=Reconcile_utils.app)
+
+        if plan['docker_orphans']:
+            with ThreadPoolExecutor(max_workers=Reconcile_utils.max_workers) as executor:
+                list(executor.map(Control_utils._remove_docker_container, list(plan['docker_orphans'])))
+
+        add = {}
+        for name, (_, _, challenge_id, remote_info, _) in plan['missing_rules'].items():
+            spec = Spec_utils.get(challenge_id)
+            if spec is None:
+                continue
+            try:
+                ip = State_utils.get_ip(container_network, name)
+            except Exception:
+                continue
+            rule = Frpc_utils.build_rule(ip, str(spec.redirect_port), str(remote_info), spec.redirect_type, name)
+            if rule is not None:
+                add[name] = rule
+        delete = plan['rule_orphans'] + [name for name in plan['row_orphans'] if name in plan['rules']]
+        if add or delete:
+            results = Frpc_utils.apply_rules(
+                plugin_configs.get("frpc_api_ip"), plugin_configs.get("frpc_api_port"), add=add, delete=delete
+            )
+            report['rules_failed'] = sorted(name for name, ok in results.items() if not ok)
+
+        DBUtils.remove_containers([row[0] for row in plan['row_orphans'].values()])
+
+        # 孤儿记录和孤儿容器占用的端口都回收到端口池
+        ports = [row[3] for row in plan['row_orphans'].values()] + list(plan['docker_orphans'].values())
+        for port in ports:
+            if port and str(port).isdigit() and DBUtils.get_container_by_port(port) == None:
+                redis_util.add_available_port(port)
+
+        # 修复端口池, 找回崩溃时已分配但没有写入记录的端口; 先结束当前事务, 用最新的数据判断端口是否在用
+        db.session.commit()
+        Control_utils.init_ports(force=False)
+
+        report['last_run'] = int(started)
+        report['duration'] = round(time.time() - started, 3)
+        cache.set(Reconcile_utils.report_key, report, timeout=0)
+        return report
+
+    @staticmethod
+    def get_report():
+        return cache.get(Reconcile_utils.report_key)
+
+    @staticmethod
+    def reconcile_job():
+        # 多个 worker 都会调度该任务, 同一时刻只允许一个 worker 对账
+        redis_util = RedisUtils(app=Reconcile_utils.app)
+        if not redis_util.acquire_lock('reconcile', 300):
+            return
+        try:
+            with Reconcile_utils.app.app_context():
+                try:
+                    Reconcile_utils.reconcile()
+                finally:
+                    db.session.remove()
+        finally:
+            redis_util.release_lock('reconcile')
@@ -0,0 +1,182 @@
+# coding=utf-8
+from __future__ import division  # Use floating point for math calculations
+
+import math
+
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.orm import Session, object_session
+
+from CTFd.cache import cache, clear_standings
+from CTFd.models import Challenges, Solves, Teams, Users, db
+from CTFd.utils.modes import get_model
+
+from .Cache_utils import Cache_utils
+
+
+class Score_utils(object):
+    # 每道题目可见解题数的增量计数
+    # 计数保存在 CTFd 的共享缓存中, 解题时原子加一; 账号被隐藏/封禁/删除或解题记录被删除时
+    # 在事务提交后更新版本号使全部计数失效, 下一次读取时重新 COUNT. 计数带有过期时间, 同时作为定期校正
+    timeout = 3600
+
+    @staticmethod
+    def _key(challenge_id):
+        version = Cache_utils.get_version('solvecounts')
+        if version is None:
+            version = Cache_utils.bump_version('solvecounts')
+        return 'plugin_dynamic_solves_' + version + '_' + str(challenge_id)
+
+    @staticmethod
+    def count_solves(challenge_id):
+        Model = get_model()
+
+        return (
+            Solves.query.join(Model, Solves.account_id == Model.id)
+            .filter(
+                Solves.challenge_id == challenge_id,
+                Model.hidden == False,
+                Model.banned == False,
+            )
+            .count()
+        )
+
+    @staticmethod
+    def get_solve_count(challenge_id):
+        key = Score_utils._key(challenge_id)
+        solve_count = cache.get(key)
+        if solve_count is None:
+            solve_count = Score_utils.count_solves(challenge_id)
+            cache.set(key, solve_count, timeout=Score_utils.timeout)
+        return int(solve_count)
+
+    @staticmethod
+    def record_solve(challenge_id, account):
+        # 在解题记录提交之后调用, 返回最新的可见解题数
+        key = Score_utils._key(challenge_id)
+        if cache.get(key) is None or account.hidden or account.banned:
+            # 没有计数时直接 COUNT, 结果已包含本次解题, 不再加一
+            return Score_utils.get_solve_count(challenge_id)
+        # Flask-Caching 的 Cache 包装没有 inc, 使用后端对象 (Redis 后端为原子 INCR)
+        solve_count = cache.cache.inc(key)
+        if solve_count is None or int(solve_count) == 1:
+            # 计数在 get 和 inc 之间过期时 INCR 会新建一个没有过期时间的计数, 重新 COUNT 并带过期时间写入
+            solve_count = Score_utils.count_solves(challenge_id)
+            cache.set(key, solve_count, timeout=Score_utils.timeout)
+        return int(solve_count)
+
+    @staticmethod
+    def invalidate(*args):
+        Cache_utils.bump_version('solvecounts')
+
+    @staticmethod
+    def _mark(session):
+        if session is not None:
+            session.info['plugin_dynamic_solvecounts_changed'] = True
+        else:
+            Score_utils.invalidate()
+
+    @staticmethod
+    def _account_changed(mapper, connection, target):
+        state = inspect(target)
+        if state.attrs.hidden.history.has_changes() or state.attrs.banned.history.has_changes():
+            Score_utils._mark(object_session(target))
+
+    @staticmethod
+    def _row_deleted(mapper, connection, target):
+        Score_utils._mark(object_session(target))
+
+    @staticmethod
+    def _bulk_deleted(delete_context):
+        # CTFd 删除用户/队伍及其解题记录时使用 Query.delete(), 不会触发 mapper 的 after_delete
+        mapper = getattr(delete_context, 'mapper', None)
+        if mapper is not None:
+            entity = mapper.class_
+        else:
+            entity = delete_context.query.column_descriptions[0]['entity']
+        if entity in (Users, Teams, Solves):
+            Score_utils._mark(delete_context.session)
+
+    @staticmethod
+    def _after_commit(session):
+        # 事务提交后才使计数失效, 避免其他 worker 用未提交的数据重新计数
+        if session.info.pop('plugin_dynamic_solvecounts_changed', False):
+            Score_utils.invalidate()
+
+    @staticmethod
+    def register_listeners():
+        for Model in (Users, Teams):
+            event.listen(Model, 'after_update', Score_utils._account_changed)
+            event.listen(Model, 'after_delete', Score_utils._row_deleted)
+        event.listen(Solves, 'after_delete', Score_utils._row_deleted)
+        event.listen(Session, 'after_bulk_delete', Score_utils._bulk_deleted)
+        event.listen(Session, 'after_commit', Score_utils._after_commit)
+
+    @staticmethod
+    def compute_value(challenge, solve_count):
+        return Score_utils.decay_value(challenge.initial, challenge.minimum, challenge.decay, solve_count)
+
+    @staticmethod
+    def decay_value(initial, minimum, decay, solve_count):
+        # If the solve count is 0 we shouldn't manipulate the solve count to
+        # let the math update back to normal
+        if solve_count != 0:
+            # We subtract -1 to allow the first solver to get max point value
+            solve_count -= 1
+
+        # It is important that this calculation takes into account floats.
+        # Hence this file uses from __future__ import division
+        value = (
+            ((minimum - initial) / (decay ** 2))
+            * (solve_count ** 2)
+        ) + initial
+
+        value = math.ceil(value)
+
+        if value < minimum:
+            value = minimum
+
+        return value
+
+    @staticmethod
+    def rescore_all():
+        # 批量重新计算所有 plugin-dynamic 题目的分值:
+        # 一次 GROUP BY 取出全部可见解题数, 在内存中计算衰减公式, 再用一条 UPDATE ... CASE 写回
+        # 延迟导入, 避免与 __init__ 中的挑战模型循环引用
+        from . import DynamicChallengeExc
+        Model = get_model()
+
+        counts = dict(
+            db.session.query(Solves.challenge_id, func.count(Solves.id))
+            .join(Model, Solves.account_id == Model.id)
+            .filter(Model.hidden == False, Model.banned == False)
+            .group_by(Solves.challenge_id)
+            .all()
+        )
+        challenges = [
+            (c.id, c.initial, c.minimum, c.decay, c.value)
+            for c in DynamicChallengeExc.query.all()
+        ]
+
+        values = {}
+        for challenge_id, initial, minimum, decay, value in challenges:
+            new_value = Score_utils.decay_value(initial, minimum, decay, counts.get(challenge_id, 0))
+            if new_value != value:
+                values[challenge_id] = new_value
+
+        if values:
+            db.session.execute(
+                Challenges.__table__.update()
+                .where(Challenges.id.in_(list(values.keys())))
+                .values(value=case(values, value=Challenges.id))
+            )
+            db.session.commit()
+            # 排行榜缓存中还是旧分值
+            clear_standings()
+
+        # 顺便用准确的结果重置增量计数
+        Score_utils.invalidate()
+        cache.set_many(
+            dict((Score_utils._key(c[0]), counts.get(c[0], 0)) for c in challenges),
+            timeout=Score_utils.timeout
+        )
+        return len(challenges), len(values)
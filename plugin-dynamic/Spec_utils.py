@@ -0,0 +1,66 @@
+# coding=utf-8
+import collections
+import threading
+
+from .Cache_utils import Cache_utils
+
+# 启动一个题目容器所需的全部信息, 不可变
+LaunchSpec = collections.namedtuple('LaunchSpec', ['challenge_id', 'docker_image', 'redirect_port', 'redirect_type', 'state'])
+
+
+class Spec_utils(object):
+    # 题目启动参数的 LRU 缓存
+    # 容器相关接口只读取 LaunchSpec, 常见情况下不再查询 DynamicChallengeExc;
+    # 题目修改/删除时更新 Cache_utils 中的版本号, 所有 worker 的缓存随之失效
+    max_size = 256
+
+    _specs = collections.OrderedDict()
+    _version = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get(challenge_id):
+        try:
+            challenge_id = int(challenge_id)
+        except (TypeError, ValueError):
+            return None
+
+        version = Cache_utils.get_version('launchspecs')
+        with Spec_utils._lock:
+            if version is None or version != Spec_utils._version:
+                Spec_utils._specs.clear()
+            else:
+                spec = Spec_utils._specs.get(challenge_id)
+                if spec is not None:
+                    Spec_utils._specs.move_to_end(challenge_id)
+                    return spec
+
+        # 延迟导入, 避免与 __init__ 中的挑战模型循环引用
+        from . import DynamicChallengeExc
+        challenge = DynamicChallengeExc.query.filter_by(id=challenge_id).first()
+        if challenge is None:
+            return None
+        spec = LaunchSpec(
+            challenge_id=challenge.id,
+            docker_image=challenge.docker_image,
+            redirect_port=challenge.redirect_port,
+            redirect_type=challenge.redirect_type,
+            state=challenge.state,
+        )
+
+        if version is None:
+            version = Cache_utils.bump_version('launchspecs')
+        with Spec_utils._lock:
+            if version != Spec_utils._version:
+                Spec_utils._specs.clear()
+                Spec_utils._version = version
+            Spec_utils._specs[challenge_id] = spec
+            while len(Spec_utils._specs) > Spec_utils.max_size:
+                Spec_utils._specs.popitem(last=False)
+        return spec
+
+    @staticmethod
+    def invalidate(challenge_id):
+        with Spec_utils._lock:
+            Spec_utils._specs.pop(int(challenge_id), None)
+        Cache_utils.bump_version('launchspecs')
@@ -0,0 +1,146 @@
+# coding=utf-8
+import re
+import threading
+import time
+
+import docker
+
+from .Docker_utils import Docker_utils
+
+
+class State_utils(object):
+    # 由 Docker 事件流维护的容器状态索引
+    # 后台线程先全量列出一次插件容器, 再订阅 container 事件 (start/die/destroy/rename/...) 增量更新,
+    # 查询 IP、状态时直接读内存, 不再每次请求都调用 Docker API.
+    # 事件流断开后重新全量同步; 同步完成前 synced 为 False, 调用方应退回直接查询 Docker
+    NAME_PATTERN = re.compile(r'^(pool-\d+-|\d+-)[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+    retry_interval = 5
+
+    synced = False
+
+    # name -> {'id', 'status', 'networks': {network: ip}, 'started_at', 'exit_code'}
+    _index = {}
+    _lock = threading.Lock()
+    _thread = None
+
+    @staticmethod
+    def start():
+        if State_utils._thread is not None and State_utils._thread.is_alive():
+            return
+        State_utils._thread = threading.Thread(target=State_utils._run, name='plugin-dynamic-docker-events')
+        State_utils._thread.daemon = True
+        State_utils._thread.start()
+
+    @staticmethod
+    def _managed(name):
+        return bool(name) and State_utils.NAME_PATTERN.match(name) is not None
+
+    @staticmethod
+    def _inspect(api, container_id):
+        attrs = api.inspect_container(container_id)
+        networks = attrs['NetworkSettings'].get('Networks') or {}
+        return {
+            'id': attrs['Id'],
+            'status': attrs['State']['Status'],
+            'networks': dict((n, v.get('IPAddress') or None) for n, v in networks.items()),
+            'started_at': attrs['State'].get('StartedAt'),
+            'exit_code': attrs['State'].get('ExitCode'),
+        }
+
+    @staticmethod
+    def _sync(api):
+        index = {}
+        for c in api.containers(all=True):
+            name = c['Names'][0].lstrip('/') if c.get('Names') else None
+            if not State_utils._managed(name):
+                continue
+            networks = (c.get('NetworkSettings') or {}).get('Networks') or {}
+            index[name] = {
+                'id': c['Id'],
+                'status': c['State'],
+                'networks': dict((n, v.get('IPAddress') or None) for n, v in networks.items()),
+                'started_at': None,
+                'exit_code': None,
+            }
+        with State_utils._lock:
+            State_utils._index = index
+            State_utils.synced = True
+
+    @staticmethod
+    def _handle(api, event):
+        action = event.get('Action') or event.get('status') or ''
+        attributes = (event.get('Actor') or {}).get('Attributes') or {}
+        name = attributes.get('name')
+        if action == 'rename':
+            old_name = (attributes.get('oldName') or '').lstrip('/')
+            with State_utils._lock:
+                entry = State_utils._index.pop(old_name, None)
+                if entry is not None and State_utils._managed(name):
+                    State_utils._index[name] = entry
+            if entry is not None or not State_utils._managed(name):
+                return
+        if not State_utils._managed(name):
+            return
+        if action == 'destroy':
+            with State_utils._lock:
+                State_utils._index.pop(name, None)
+            return
+        if action in ('rename', 'create', 'start', 'restart', 'die', 'pause', 'unpause', 'stop', 'kill', 'oom'):
+            # 状态变化时 inspect 一次, 而不是每次查询时
+            try:
+                entry = State_utils._inspect(api, (event.get('Actor') or {}).get('ID') or name)
+            except docker.errors.NotFound:
+                with State_utils._lock:
+                    State_utils._index.pop(name, None)
+                return
+            if action == 'die' and attributes.get('exitCode') is not None:
+                entry['exit_code'] = int(attributes['exitCode'])
+            with State_utils._lock:
+                State_utils._index[name] = entry
+
+    @staticmethod
+    def _run():
+        while True:
+            try:
+                # 事件流是长连接, 使用单独的客户端, 不受共享客户端的超时和重建影响
+                api = docker.APIClient(base_url=Docker_utils.base_url)
+                since = int(time.time())
+                State_utils._sync(api)
+                for event in api.events(since=since, filters={'type': 'container'}, decode=True):
+                    State_utils._handle(api, event)
+            except Exception:
+                pass
+            with State_utils._lock:
+                State_utils.synced = False
+            time.sleep(State_utils.retry_interval)
+
+    @staticmethod
+    def get(container_name):
+        with State_utils._lock:
+            entry = State_utils._index.get(container_name)
+            return dict(entry) if entry is not None else None
+
+    @staticmethod
+    def get_ip(container_network, container_name):
+        # 索引中没有 IP (未同步或 start 事件尚未到达) 时退回查询 Docker
+        entry = State_utils.get(container_name)
+        if entry is not None and entry['status'] == 'running' and entry['networks'].get(container_network):
+            return entry['networks'][container_network]
+        return Docker_utils.getIPAdress_container(container_network=container_network, container_name=container_name)
+
+    @staticmethod
+    def get_status(container_name):
+        # 返回 running/exited/... ; 已同步但索引中不存在时为 missing, 未同步时为 None
+        with State_utils._lock:
+            if not State_utils.synced:
+                return None
+            entry = State_utils._index.get(container_name)
+            return entry['status'] if entry is not None else 'missing'
+
+    @staticmethod
+    def get_summary():
+        with State_utils._lock:
+            summary = {'synced': State_utils.synced, 'total': len(State_utils._index)}
+            for entry in State_utils._index.values():
+                summary[entry['status']] = summary.get(entry['status'], 0) + 1
+        return summary
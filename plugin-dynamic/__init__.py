@@ -1,12 +1,12 @@
 # coding=utf-8
 from __future__ import division  # Use floating point for math calculations
 
-import math
-import uuid
 import json
 from datetime import datetime
+from urllib.parse import urlencode
 
-from flask import Blueprint, render_template, request
+from flask import Blueprint, Response, g, render_template, request, stream_with_context
+from flask_apscheduler import APScheduler
 
 from CTFd.models import (
     ChallengeFiles,
@@ -19,9 +19,8 @@ from CTFd.models import (
     db,
 )
 from CTFd.plugins import register_plugin_assets_directory
+from CTFd.plugins.migrations import upgrade
 from CTFd.plugins.challenges import CHALLENGE_CLASSES, BaseChallenge
-from CTFd.plugins.flags import get_flag_class
-from CTFd.utils.modes import get_model
 from CTFd.utils.uploads import delete_file
 from CTFd.utils.user import get_ip
 from CTFd.utils import user as current_user
@@ -29,6 +28,16 @@ from CTFd.utils.decorators import admins_only, authed_only
 from .dbUtils import DBUtils
 from .Docker_utils import Docker_utils
 from .Frpc_utils import Frpc_utils
+from .Control_utils import Control_utils
+from .Job_utils import Job_utils
+from .Pool_utils import Pool_utils
+from .Spec_utils import Spec_utils
+from .Score_utils import Score_utils
+from .Flag_utils import Flag_utils
+from .Fails_utils import Fails_utils
+from .Limit_utils import Limit_utils
+from .State_utils import State_utils
+from .Reconcile_utils import Reconcile_utils
 
 
 
@@ -57,38 +66,12 @@ class PulginDynamicChallenge(BaseChallenge):
     )
 
     @classmethod
-    def calculate_value(cls, challenge):
-        Model = get_model()
-
-        solve_count = (
-            Solves.query.join(Model, Solves.account_id == Model.id)
-            .filter(
-                Solves.challenge_id == challenge.id,
-                Model.hidden == False,
-                Model.banned == False,
-            )
-            .count()
-        )
-
-        # If the solve count is 0 we shouldn't manipulate the solve count to
-        # let the math update back to normal
-        if solve_count != 0:
-            # We subtract -1 to allow the first solver to get max point value
-            solve_count -= 1
-
-        # It is important that this calculation takes into account floats.
-        # Hence this file uses from __future__ import division
-        value = (
-            ((challenge.minimum - challenge.initial) / (challenge.decay ** 2))
-            * (solve_count ** 2)
-        ) + challenge.initial
+    def calculate_value(cls, challenge, solve_count=None):
+        # 解题数来自 Score_utils 维护的增量计数, 常见情况下不再执行 COUNT
+        if solve_count is None:
+            solve_count = Score_utils.get_solve_count(challenge.id)
 
-        value = math.ceil(value)
-
-        if value < challenge.minimum:
-            value = challenge.minimum
-
-        challenge.value = value
+        challenge.value = Score_utils.compute_value(challenge, solve_count)
         db.session.commit()
         return challenge
 
@@ -159,7 +142,10 @@ class PulginDynamicChallenge(BaseChallenge):
                 value = float(value)
             setattr(challenge, attr, value)
 
-        return PulginDynamicChallenge.calculate_value(challenge)
+        challenge = PulginDynamicChallenge.calculate_value(challenge)
+        # 镜像/端口/映射方式可能已修改
+        Spec_utils.invalidate(challenge.id)
+        return challenge
 
     @staticmethod
     def delete(challenge):
@@ -169,6 +155,7 @@ class PulginDynamicChallenge(BaseChallenge):
         :param challenge:
         :return:
         """
+        challenge_id = challenge.id
         Fails.query.filter_by(challenge_id=challenge.id).delete()
         Solves.query.filter_by(challenge_id=challenge.id).delete()
         Flags.query.filter_by(challenge_id=challenge.id).delete()
@@ -181,6 +168,7 @@ class PulginDynamicChallenge(BaseChallenge):
         DynamicChallengeExc.query.filter_by(id=challenge.id).delete()
         Challenges.query.filter_by(id=challenge.id).delete()
         db.session.commit()
+        Spec_utils.invalidate(challenge_id)
 
     @staticmethod
     def attempt(challenge, request):
@@ -195,10 +183,25 @@ class PulginDynamicChallenge(BaseChallenge):
         """
         data = request.form or request.get_json()
         submission = data["submission"].strip()
-        flags = Flags.query.filter_by(challenge_id=challenge.id).all()
-        for flag in flags:
-            if get_flag_class(flag.type).compare(flag, submission):
-                return True, "Correct"
+        # 提交过快或尝试次数用尽时直接拒绝, 不比较 flag, 也不记录 Fails
+        user = current_user.get_current_user()
+        if not Limit_utils.allow(user.id, user.team_id, challenge.id):
+            g.plugin_dynamic_refused = True
+            return False, "You are submitting flags too fast. Slow down."
+        # 缓冲中尚未写入数据库的错误提交也计入尝试次数
+        if challenge.max_attempts and Fails_utils.enabled:
+            account_id = user.account_id
+            pending = Fails_utils.pending_count(account_id, challenge.id)
+            if pending:
+                fails = Fails.query.filter(
+                    Fails.account_id == account_id, Fails.challenge_id == challenge.id
+                ).count()
+                if fails + pending >= challenge.max_attempts:
+                    g.plugin_dynamic_refused = True
+                    return False, "You have 0 tries remaining"
+        # 使用预编译的匹配器, 常见情况下不查询 Flags
+        if Flag_utils.compare(challenge.id, submission):
+            return True, "Correct"
         return False, "Incorrect"
 
     @staticmethod
@@ -225,7 +228,8 @@ class PulginDynamicChallenge(BaseChallenge):
         db.session.add(solve)
         db.session.commit()
 
-        PulginDynamicChallenge.calculate_value(challenge)
+        solve_count = Score_utils.record_solve(challenge.id, team if team else user)
+        PulginDynamicChallenge.calculate_value(challenge, solve_count=solve_count)
 
     @staticmethod
     def fail(user, team, challenge, request):
@@ -237,8 +241,19 @@ class PulginDynamicChallenge(BaseChallenge):
         :param request: The request the user submitted
         :return:
         """
+        if g.get("plugin_dynamic_refused"):
+            return
         data = request.form or request.get_json()
         submission = data["submission"].strip()
+        if Fails_utils.enabled:
+            Fails_utils.add(
+                user_id=user.id,
+                team_id=team.id if team else None,
+                challenge_id=challenge.id,
+                ip=get_ip(request),
+                provided=submission,
+            )
+            return
         wrong = Fails(
             user_id=user.id,
             team_id=team.id if team else None,
@@ -267,8 +282,8 @@ class DynamicChallengeExc(Challenges):
 
 
 def load(app):
-    # upgrade()
     app.db.create_all()
+    upgrade()
     CHALLENGE_CLASSES["plugin-dynamic"] = PulginDynamicChallenge
     register_plugin_assets_directory(
         app, base_path="/plugins/plugin-dynamic/assets/"
@@ -285,6 +300,65 @@ def load(app):
     # # 定义映射端口列表
     # port_range = []
 
+    def apply_configs(configs):
+        # 共享的 Docker 客户端
+        Docker_utils.configure(timeout=configs.get("docker_api_timeout"))
+        # 容器创建任务的后台线程池
+        Job_utils.configure(max_workers=configs.get("provision_workers"))
+        # 预热容器池, 由定时任务在后台补充
+        Pool_utils.configure(target_size=configs.get("warm_pool_size"))
+        # 错误提交的写后缓冲
+        Fails_utils.configure(
+            enabled=configs.get("fail_buffer_enabled"),
+            max_rows=configs.get("fail_buffer_size"),
+            interval=configs.get("fail_buffer_interval"),
+        )
+        # 对账时跳过创建不足 reconcile_grace 秒的容器和记录
+        Reconcile_utils.configure(grace=configs.get("reconcile_grace"))
+        # 提交频率限制
+        Limit_utils.configure(
+            limit=configs.get("submission_limit"),
+            window=configs.get("submission_window"),
+            backend=configs.get("submission_limit_backend"),
+        )
+
+    # 任意 worker 保存配置后, 其他 worker 在下一次读取配置时通过版本号发现变化并重新应用
+    Job_utils.init_app(app)
+    Frpc_utils.init_app(app)
+    Pool_utils.init_app(app)
+    Fails_utils.init_app(app, "plugin-dynamic")
+    Limit_utils.init_app(app)
+    Reconcile_utils.init_app(app)
+    DBUtils.config_listeners.append(apply_configs)
+    apply_configs(DBUtils.get_all_pluginconfigs())
+
+    # 订阅 Docker 事件, 在内存中维护容器状态和 IP
+    State_utils.start()
+
+    # 端口池保存在 Redis 中, 只有第一个启动的 worker 需要根据数据库重建, 之后的启动只补回丢失的端口
+    Control_utils.init_ports(force=False)
+
+    scheduler = APScheduler()
+    scheduler.init_app(app)
+    scheduler.start()
+    scheduler.add_job(id='plugin-dynamic-pool-refill', func=Pool_utils.refill_job, trigger="interval", seconds=10, max_instances=1, coalesce=True)
+
+    # 可见解题数的增量计数在账号隐藏/封禁/删除时失效
+    Score_utils.register_listeners()
+    # Flags 修改后使对应题目的匹配器失效
+    Flag_utils.register_listeners()
+
+    def auto_clean_container():
+        with app.app_context():
+            try:
+                Control_utils.auto_clean_container()
+            finally:
+                db.session.remove()
+
+    scheduler.add_job(id='plugin-dynamic-reaper', func=auto_clean_container, trigger="interval", seconds=10, max_instances=1, coalesce=True)
+    # Docker/frpc/数据库三方对账, 清理崩溃后遗留的孤儿
+    scheduler.add_job(id='plugin-dynamic-reconcile', func=Reconcile_utils.reconcile_job, trigger="interval", seconds=60, max_instances=1, coalesce=True)
+
     @page_blueprint.route('/settings', methods=['GET'])
     @admins_only
     def plugin_list_configs():
@@ -298,11 +372,8 @@ def load(app):
     def plugin_save_configs():
         req = request.get_json()
         DBUtils.save_all_pluginconfigs(req.items())
-        # redis_util = RedisUtils(app=app)
-        # redis_util.init_redis_port_sets()
-        DBUtils.MaxPort = DBUtils.get_all_pluginconfigs().get("server_port_maximum")
-        DBUtils.MinPort = DBUtils.get_all_pluginconfigs().get("server_port_minimum")
-        DBUtils.port_range = list(range(int(DBUtils.MinPort), int(DBUtils.MaxPort)+1))
+        # 端口范围可能已修改, 重建所有 worker 共享的端口池
+        Control_utils.init_ports(force=True)
         return json.dumps({'success': True})
 
 
@@ -313,71 +384,46 @@ def load(app):
         req = request.get_json()
         challenge_id = req.get("challenge_id")
         if DBUtils.get_container_by_user(user_id) == None:
-            # 首先创建添加容器所需要的元素
-            plugin_configs = DBUtils.get_all_pluginconfigs()
-            container_network = plugin_configs.get("container_network")
-            uuid_code = uuid.uuid4()
-            container_name = str(user_id) + "-" + str(uuid_code) 
-            docker_image = DynamicChallengeExc.query.filter_by(id=challenge_id).first().docker_image
-            container_port = DynamicChallengeExc.query.filter_by(id=challenge_id).first().redirect_port
-            mode = DynamicChallengeExc.query.filter_by(id=challenge_id).first().redirect_type
-            rule_name = container_name
-            api_adress = plugin_configs.get("frpc_api_ip")
-            api_port = plugin_configs.get("frpc_api_port")
-
-            # 生成挑战对应的docker容器
-
-            # Docker_utils.create_container(container_network=container_network, container_name=container_name, image_name=docker_image)
-
-            if mode == "digital_port":
-                if len(DBUtils.port_range) == 0:
-                    
-                    return json.dumps({'success': False, 'msg':'Running container reached upper limit'})
-                
-                remote_info = DBUtils.port_range.pop()
-
-            elif mode == "dynamic_host":
-                
-                remote_info = container_name
-
-            else:
-                return json.dumps({'success': False, 'msg':'This mode does not exist'})
-            # 启动容器
-            Docker_utils.create_container(container_network=container_network, container_name=container_name, image_name=docker_image)
-            # 将启动的容器信息存入数据库ChallengeContainerV2
-            DBUtils.create_new_container(user_id=user_id, challenge_id=challenge_id, uuid=uuid_code, remote_info=str(remote_info))
-            # 获取启动成功的容器IP
-            container_ip = Docker_utils.getIPAdress_container(container_network=container_network, container_name=container_name)
-            # 设置Frp的映射规则
-            Frpc_utils.add_frpcRule(container_ip=container_ip, container_ip_port=str(container_port), remote_info=str(remote_info), mode=mode, rule_name=container_name, api_adress=api_adress, api_adress_port=str(api_port))
-
-            return json.dumps({'success': True})
+            # 容器的创建交给后台任务队列, 前端通过 job_id 轮询进度
+            job_id = Job_utils.submit(user_id, Control_utils.add_container, user_id, challenge_id)
+            return json.dumps({'success': True, 'job_id': job_id})
 
         else:
             return json.dumps({'success': False, 'msg': 'You have created a container. If you want to create a new container, first destroy the old container.'})
 
+    @page_blueprint.route('/container-job', methods=['GET'])
+    @authed_only
+    def get_container_job():
+        user_id = current_user.get_current_user().id
+        job = Job_utils.get_status(request.args.get('job_id'))
+        if job == None or job.get('user_id') != user_id:
+            return json.dumps({'success': False, 'msg': 'This job does not exist'})
+        return json.dumps({'success': True, 'status': job.get('status'), 'msg': job.get('msg')})
+
 
     @page_blueprint.route('/container', methods=['GET'])
     @authed_only
     def get_containerinfo():
         user_id = current_user.get_current_user().id
         challenge_id = request.args.get('challenge_id')
-        mode = DynamicChallengeExc.query.filter_by(id=challenge_id).first().redirect_type
+        spec = Spec_utils.get(challenge_id)
         challenge_info = DBUtils.get_current_containers(user_id, challenge_id)
         plugin_configs = DBUtils.get_all_pluginconfigs()
 
-        if challenge_info == None:
+        if spec == None or challenge_info == None:
 
             return json.dumps({'success': False,'msg':'Container has not been created by the current user'})
 
+        mode = spec.redirect_type
+        remaining_time = int((challenge_info.expires_at - datetime.now()).total_seconds())
         if mode == "digital_port":
             remote_port = challenge_info.remote_info
             server_ip = plugin_configs.get("server_ip")
-            return json.dumps({'success': True, 'server_ip': server_ip, 'remote_port': remote_port, 'type':mode})
+            return json.dumps({'success': True, 'server_ip': server_ip, 'remote_port': remote_port, 'type':mode, 'remaining_time': remaining_time, 'status': State_utils.get_status(challenge_info.container_name)})
         elif mode == "dynamic_host":
             subdomain = challenge_info.remote_info
             server_domain = plugin_configs.get("server_domain")
-            return json.dumps({'success': True, 'server_domain': server_domain, 'subdomain': subdomain, 'type':mode})
+            return json.dumps({'success': True, 'server_domain': server_domain, 'subdomain': subdomain, 'type':mode, 'remaining_time': remaining_time, 'status': State_utils.get_status(challenge_info.container_name)})
         else:
             return json.dumps({'success': False, 'msg':'This mode does not exist'})
 
@@ -386,25 +432,8 @@ def load(app):
     @authed_only
     def dele_container():
         user_id = current_user.get_current_user().id
-        challenge_id = request.args.get('challenge_id')
-        challenge_info = DBUtils.get_container_by_user(user_id)
-        if challenge_info == None:
-            return json.dumps({'success': False,'msg':'Container has not been created by the current user'})
-        mode = DynamicChallengeExc.query.filter_by(id=challenge_id).first().redirect_type
-        if mode == "digital_port":
-            if int(challenge_info.remote_info) >= int(DBUtils.MinPort) and int(challenge_info.remote_info) <= int(DBUtils.MaxPort):
-                DBUtils.port_range.append(int(challenge_info.remote_info))
-        # 删除当前用户创建的容器
-        container_name = str(challenge_info.user_id) + "-" + str(challenge_info.uuid)
-        Docker_utils.remove_container(container_name)
-        # 删除当前用户创建的容器的映射规则
-        plugin_configs = DBUtils.get_all_pluginconfigs()
-        api_adress = plugin_configs.get("frpc_api_ip")
-        api_port = plugin_configs.get("frpc_api_port")
-        Frpc_utils.delete_frpcRule(rule_name= container_name, api_adress=api_adress, api_adress_port=api_port)
-        # 删除当前数据库中的数据
-        DBUtils.remove_current_container(user_id)
-        return json.dumps({'success': True, 'msg':'deleted'})
+        result, msg = Control_utils.remove_container(user_id)
+        return json.dumps({'success': result, 'msg': msg})
 
     @page_blueprint.route('/container-reload', methods=['POST'])
     @authed_only
@@ -412,107 +441,153 @@ def load(app):
         user_id = current_user.get_current_user().id
         req = request.get_json()
         challenge_id = req.get("challenge_id")
-        # 首先删除当前用户创建的容器
-        challenge_info = DBUtils.get_container_by_user(user_id)
-        if challenge_info == None:
-            return json.dumps({'success': False,'msg':'Container has not been created by the current user'})
-        mode = DynamicChallengeExc.query.filter_by(id=challenge_id).first().redirect_type
+        # 原地重置容器, 不再销毁重建, 也不修改 frpc 规则
+        result, msg = Control_utils.reset_container(user_id, challenge_id)
+        return json.dumps({'success': result, 'msg': msg})
 
-        if mode == "digital_port":
-            if int(challenge_info.remote_info) >= int(DBUtils.MinPort) and int(challenge_info.remote_info) <= int(DBUtils.MaxPort):
-                DBUtils.port_range.append(int(challenge_info.remote_info))
 
-        # 删除当前用户创建的容器
-        container_name = str(challenge_info.user_id) + "-" + str(challenge_info.uuid)
-        Docker_utils.remove_container(container_name)
-        # 删除当前用户创建的容器的映射规则
-        plugin_configs = DBUtils.get_all_pluginconfigs()
-        api_adress = plugin_configs.get("frpc_api_ip")
-        api_port = plugin_configs.get("frpc_api_port")
-        Frpc_utils.delete_frpcRule(rule_name= container_name, api_adress=api_adress, api_adress_port=api_port)
-        # 删除当前数据库中的数据
-        DBUtils.remove_current_container(user_id)
+    @page_blueprint.route('/container-renew', methods=['POST'])
+    @authed_only
+    def renew_container():
+        user_id = current_user.get_current_user().id
+        req = request.get_json()
+        challenge_id = req.get("challenge_id")
+        result, msg = Control_utils.renew_container(user_id, challenge_id)
+        return json.dumps({'success': result, 'msg': msg})
 
-        # 开始创建新的容器
-        if DBUtils.get_container_by_user(user_id) == None:
-            # 首先创建添加容器所需要的元素
-            container_network = plugin_configs.get("container_network")
-            uuid_code = uuid.uuid4()
-            container_name = str(user_id) + "-" + str(uuid_code) 
-            docker_image = DynamicChallengeExc.query.filter_by(id=challenge_id).first().docker_image
-            container_port = DynamicChallengeExc.query.filter_by(id=challenge_id).first().redirect_port
-            rule_name = container_name
-
-            # 生成挑战对应的docker容器
-            # Docker_utils.create_container(container_network=container_network, container_name=container_name, image_name=docker_image)
-
-            if mode == "digital_port":
-                if len(DBUtils.port_range) == 0:
-                    
-                    return json.dumps({'success': False, 'msg':'Running container reached upper limit'})
-                
-                remote_info = DBUtils.port_range.pop()
-
-            elif mode == "dynamic_host":
-                
-                remote_info = container_name
-
-            else:
-                return json.dumps({'success': False, 'msg':'This mode does not exist'})
-            # 启动容器
-            Docker_utils.create_container(container_network=container_network, container_name=container_name, image_name=docker_image)
-            # 将启动的容器信息存入数据库ChallengeContainerV2
-            DBUtils.create_new_container(user_id=user_id, challenge_id=challenge_id, uuid=uuid_code, remote_info=str(remote_info))
-            # 获取启动成功的容器IP
-            container_ip = Docker_utils.getIPAdress_container(container_network=container_network, container_name=container_name)
-            # 设置Frp的映射规则
-            Frpc_utils.add_frpcRule(container_ip=container_ip, container_ip_port=str(container_port), remote_info=str(remote_info), mode=mode, rule_name=container_name, api_adress=api_adress, api_adress_port=str(api_port))
-
-            return json.dumps({'success': True})
 
+    @page_blueprint.route("/admin/containers-dele", methods=['GET'])
+    @admins_only
+    def admin_dele_containers():
+
+        user_id = request.args.get('user_id')
+        result, msg = Control_utils.remove_container(user_id)
+        return json.dumps({'success': result, 'msg': msg})
 
+    @page_blueprint.route("/admin/containers-bulk", methods=['POST'])
+    @admins_only
+    def admin_bulk_containers():
+        # 按题目和/或存活时间批量销毁或重置容器, 以 NDJSON 逐行返回进度
+        req = request.get_json() or {}
+        action = req.get("action")
+        challenge_id = int(req["challenge_id"]) if str(req.get("challenge_id") or "").isdigit() else None
+        older_than = int(req["older_than"]) if str(req.get("older_than") or "").isdigit() else None
+        if action not in ("destroy", "restart"):
+            return json.dumps({'success': False, 'msg': 'Unknown action'})
+        if challenge_id is None and older_than is None:
+            return json.dumps({'success': False, 'msg': 'Select a challenge or an age'})
+
+        containers = DBUtils.get_containers_by_filter(challenge_id=challenge_id, older_than=older_than)
+        workers = int(DBUtils.get_all_pluginconfigs().get("provision_workers") or 8)
+        if action == "destroy":
+            steps = Control_utils.iter_destroy_containers(containers, max_workers=workers)
         else:
-            return json.dumps({'success': False, 'msg': 'You have created a container. If you want to create a new container, first destroy the old container.'})
+            steps = Control_utils.iter_reset_containers(containers, max_workers=workers)
 
+        def generate():
+            for step in steps:
+                yield json.dumps(step) + "\n"
 
-    @page_blueprint.route("/admin/containers-dele", methods=['GET'])
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    @page_blueprint.route("/admin/reaper", methods=['GET'])
     @admins_only
-    def admin_dele_containers():
+    def admin_reaper_stats():
+        stats = Control_utils.get_reaper_stats()
+        stats['alive'] = DBUtils.get_all_alive_container_count()
+        return json.dumps({'success': True, 'stats': stats})
 
-        user_id = request.args.get('user_id')
-        challenge_info = DBUtils.get_container_by_user(user_id)
-        challenge_id = challenge_info.challenge_id
-        if challenge_info == None:
-            return json.dumps({'success': False,'msg':'Container has not been created by the current user'})
-        mode = DynamicChallengeExc.query.filter_by(id=challenge_id).first().redirect_type
-        if mode == "digital_port":
-            if int(challenge_info.remote_info) >= int(DBUtils.MinPort) and int(challenge_info.remote_info) <= int(DBUtils.MaxPort):
-                DBUtils.port_range.append(int(challenge_info.remote_info))
-        # 删除当前用户创建的容器
-        container_name = str(challenge_info.user_id) + "-" + str(challenge_info.uuid)
-        Docker_utils.remove_container(container_name)
-        # 删除当前用户创建的容器的映射规则
-        plugin_configs = DBUtils.get_all_pluginconfigs()
-        api_adress = plugin_configs.get("frpc_api_ip")
-        api_port = plugin_configs.get("frpc_api_port")
-        Frpc_utils.delete_frpcRule(rule_name= container_name, api_adress=api_adress, api_adress_port=api_port)
-        # 删除当前数据库中的数据
-        DBUtils.remove_current_container(user_id)
-        return json.dumps({'success': True, 'msg':'deleted'})
+    @page_blueprint.route("/admin/reconcile", methods=['GET'])
+    @admins_only
+    def admin_reconcile_report():
+        return json.dumps({'success': True, 'report': Reconcile_utils.get_report()})
+
+    @page_blueprint.route("/admin/reconcile", methods=['POST'])
+    @admins_only
+    def admin_reconcile():
+        dry_run = request.args.get("dry_run") in ("1", "true")
+        return json.dumps({'success': True, 'report': Reconcile_utils.reconcile(dry_run=dry_run)})
+
+    @page_blueprint.route("/admin/docker-state", methods=['GET'])
+    @admins_only
+    def admin_docker_state():
+        return json.dumps({'success': True, 'state': State_utils.get_summary()})
+
+    @page_blueprint.route("/admin/submission-offenders", methods=['GET'])
+    @admins_only
+    def admin_submission_offenders():
+        count = request.args.get("count", 50, type=int)
+        return json.dumps({'success': True, 'offenders': Limit_utils.get_offenders(count)})
+
+    @page_blueprint.route("/admin/rescore", methods=['POST'])
+    @admins_only
+    def admin_rescore():
+        total, updated = Score_utils.rescore_all()
+        return json.dumps({'success': True, 'challenges': total, 'updated': updated})
+
+    @app.cli.command("plugin-dynamic-rescore")
+    def rescore_command():
+        """Recalculate the value of every plugin-dynamic challenge."""
+        total, updated = Score_utils.rescore_all()
+        print("Rescored {0} challenges, {1} values changed".format(total, updated))
+
+    def query_containers():
+        # /admin/containers 与 /admin/containers-list 共用的游标分页参数
+        after = request.args.get("after", type=int)
+        before = request.args.get("before", type=int)
+        challenge_id = request.args.get("challenge_id", type=int)
+        older_than = request.args.get("older_than", type=int)
+        limit = min(max(request.args.get("limit", 10, type=int), 1), 100)
+        containers, has_more = DBUtils.get_container_page(
+            limit, after=after, before=before, challenge_id=challenge_id, older_than=older_than
+        )
+        if before is not None:
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = after is not None, has_more
+        filters = dict((k, v) for k, v in (("challenge_id", challenge_id), ("older_than", older_than), ("limit", limit)) if v is not None)
+        return {
+            "containers": containers,
+            "prev": containers[0].id if containers and has_prev else None,
+            "next": containers[-1].id if containers and has_next else None,
+            "filters": filters,
+        }
 
     @page_blueprint.route("/admin/containers", methods=['GET'])
     @admins_only
     def admin_list_containers():
+        page = query_containers()
+        return render_template(
+            "containers.html",
+            containers=page["containers"],
+            statuses=dict((c.id, State_utils.get_status(c.container_name)) for c in page["containers"]),
+            prev_id=page["prev"],
+            next_id=page["next"],
+            filters=page["filters"],
+            filter_args=urlencode(page["filters"]),
+        )
 
-        page = abs(request.args.get("page", 1, type=int))
-        results_per_page = 10
-        page_start = results_per_page * (page - 1)
-        page_end = results_per_page * (page - 1) + results_per_page
-
-        count = DBUtils.get_all_alive_container_count()
-        containers = DBUtils.get_all_alive_container_page(page_start, page_end)
-        pages = int(count / results_per_page) + int(count % results_per_page > 0)
-        return render_template("containers.html", containers=containers, pages=pages, curr_page=page, curr_page_start=page_start)
+    @page_blueprint.route("/admin/containers-list", methods=['GET'])
+    @admins_only
+    def admin_list_containers_api():
+        page = query_containers()
+        return json.dumps({
+            'success': True,
+            'containers': [{
+                'id': c.id,
+                'user_id': c.user_id,
+                'user_name': c.user.name if c.user else None,
+                'challenge_id': c.challenge_id,
+                'challenge_name': c.challenge.name if c.challenge else None,
+                'remote_info': c.remote_info,
+                'start_time': c.start_time.isoformat(),
+                'expires_at': c.expires_at.isoformat() if c.expires_at else None,
+                'renew_count': c.renew_count,
+                'status': State_utils.get_status(c.container_name),
+            } for c in page["containers"]],
+            'prev': page["prev"],
+            'next': page["next"],
+        })
 
     app.register_blueprint(page_blueprint)
 
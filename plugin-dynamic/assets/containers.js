@@ -41,6 +41,83 @@ $(".delete-container").click(function(e) {
     });
 });
 
+$("#bulk-containers").click(function(e) {
+    e.preventDefault();
+    var action = $("#bulk-action").val();
+    var params = {
+        'action': action,
+        'challenge_id': $("input[name='challenge_id']").val(),
+        'older_than': $("input[name='older_than']").val()
+    };
+    if (!params.challenge_id && !params.older_than) {
+        CTFd.ui.ezq.ezAlert({
+            title: "Fail",
+            body: "Enter a challenge ID or an age first.",
+            button: "OK"
+        });
+        return;
+    }
+
+    var body = "<span>Are you sure you want to <strong>{0}</strong> every matching container?</span>".format(
+        htmlentities(action)
+    );
+
+    CTFd.ui.ezq.ezQuery({
+        title: "Bulk " + action,
+        body: body,
+        success: function() {
+            var progress = $("#bulk-progress");
+            progress.text("Starting...");
+            CTFd.fetch("/plugins/plugin-dynamic/admin/containers-bulk", {
+                    method: "POST",
+                    credentials: "same-origin",
+                    headers: {
+                        Accept: "application/x-ndjson",
+                        "Content-Type": "application/json"
+                    },
+                    body: JSON.stringify(params)
+                })
+                .then(function(response) {
+                    // 逐行读取 NDJSON 进度
+                    var reader = response.body.getReader();
+                    var decoder = new TextDecoder();
+                    var buffer = "";
+
+                    function show(line) {
+                        var step = JSON.parse(line);
+                        if (step.success === false) {
+                            progress.text(step.msg);
+                        } else if (step.phase === "finished") {
+                            progress.text("Finished: " + step.succeeded + " succeeded, " + step.failed + " failed of " + step.total);
+                            if (step.total > 0) {
+                                setTimeout(function() { window.location.reload(); }, 1500);
+                            }
+                        } else {
+                            progress.text(step.phase + ": " + step.done + " / " + step.total);
+                        }
+                    }
+
+                    function read() {
+                        return reader.read().then(function(result) {
+                            buffer += decoder.decode(result.value || new Uint8Array(), {stream: !result.done});
+                            var lines = buffer.split("\n");
+                            buffer = lines.pop();
+                            lines.forEach(function(line) {
+                                if (line.trim()) show(line);
+                            });
+                            if (result.done) {
+                                if (buffer.trim()) show(buffer);
+                                return;
+                            }
+                            return read();
+                        });
+                    }
+                    return read();
+                });
+        }
+    });
+});
+
 // $(".renew-container").click(function(e) {
 //     e.preventDefault();
 //     var container_id = $(this).attr("container-id");
@@ -49,8 +49,10 @@ function loadInfo() {
                     '<div class="card-body">' +
                     '<h5 class="card-title">Instance Info</h5>' +
                     '<p class="card-text">'+ response.subdomain + '.' + response.server_domain + '</p>' +
+                    '<p class="card-text" id="whale-challenge-count-down">Remaining Time: ' + response.remaining_time + 's</p>' +
                     '<button type="button" class="btn btn-danger card-link" id="whale-button-destroy" onclick="CTFd._internal.challenge.destroy()">Destroy this instance</button>' +
                     '<button type="button" class="btn btn-success card-link" id="whale-button-renew" onclick="CTFd._internal.challenge.renew()">Renew this instance</button>' +
+                    '<button type="button" class="btn btn-warning card-link" id="whale-button-reset" onclick="CTFd._internal.challenge.reset()">Reset this instance</button>' +
                     '</div>' +
                     '</div>');
             } else {
@@ -58,29 +60,73 @@ function loadInfo() {
                     '<div class="card-body">' +
                     '<h5 class="card-title">Instance Info</h5>' +
                     '<p class="card-text">' + response.server_ip + ':' + response.remote_port + '</p>' +
+                    '<p class="card-text" id="whale-challenge-count-down">Remaining Time: ' + response.remaining_time + 's</p>' +
                     '<button type="button" class="btn btn-danger card-link" id="whale-button-destroy" onclick="CTFd._internal.challenge.destroy()">Destroy this instance</button>' +
                     '<button type="button" class="btn btn-success card-link" id="whale-button-renew" onclick="CTFd._internal.challenge.renew()">Renew this instance</button>' +
+                    '<button type="button" class="btn btn-warning card-link" id="whale-button-reset" onclick="CTFd._internal.challenge.reset()">Reset this instance</button>' +
                     '</div>' +
                     '</div>');
             }
 
-            // if (window.t !== undefined) {
-            //     clearInterval(window.t);
-            //     window.t = undefined;
-            // }
+            if (window.t !== undefined) {
+                clearInterval(window.t);
+                window.t = undefined;
+            }
+
+            function showAuto() {
+                const c = $('#whale-challenge-count-down')[0];
+                if (c === undefined) return;
+                const origin = c.innerHTML;
+                const second = parseInt(origin.split(": ")[1].split('s')[0]) - 1;
+                c.innerHTML = 'Remaining Time: ' + second + 's';
+                if (second < 0) {
+                    loadInfo();
+                }
+            }
+
+            window.t = setInterval(showAuto, 1000);
+        }
+    });
+};
 
-            // function showAuto() {
-            //     const c = $('#whale-challenge-count-down')[0];
-            //     if (c === undefined) return;
-            //     const origin = c.innerHTML;
-            //     const second = parseInt(origin.split(": ")[1].split('s')[0]) - 1;
-            //     c.innerHTML = 'Remaining Time: ' + second + 's';
-            //     if (second < 0) {
-            //         loadInfo();
-            //     }
-            // }
+function waitJob(job_id, success_body) {
+    var url = "/plugins/plugin-dynamic/container-job?job_id=" + job_id;
 
-            // window.t = setInterval(showAuto, 1000);
+    CTFd.fetch(url, {
+        method: 'GET',
+        credentials: 'same-origin',
+        headers: {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+    }).then(function(response) {
+        return response.json();
+    }).then(function(response) {
+        if (response.success === false) {
+            loadInfo();
+            CTFd.ui.ezq.ezAlert({
+                title: "Fail",
+                body: response.msg,
+                button: "OK"
+            });
+        } else if (response.status === 'success') {
+            loadInfo();
+            CTFd.ui.ezq.ezAlert({
+                title: "Success",
+                body: success_body,
+                button: "OK"
+            });
+        } else if (response.status === 'failed') {
+            loadInfo();
+            CTFd.ui.ezq.ezAlert({
+                title: "Fail",
+                body: response.msg,
+                button: "OK"
+            });
+        } else {
+            // 任务仍在队列中或正在执行, 显示进度后继续轮询
+            $('#whale-panel .card-title').html('Instance Info <small class="text-muted">' + (response.msg || 'Queued') + '...</small>');
+            setTimeout(function() { waitJob(job_id, success_body); }, 1000);
         }
     });
 };
@@ -129,10 +175,7 @@ CTFd._internal.challenge.destroy = function() {
 
 CTFd._internal.challenge.renew = function() {
     var challenge_id = parseInt($('#challenge-id').val());
-    var url = "/plugins/plugin-dynamic/container-reload"
-
-    $('#whale-button-renew')[0].innerHTML = "Waiting...";
-    $('#whale-button-renew')[0].disabled = true;
+    var url = "/plugins/plugin-dynamic/container-renew"
 
     var params = {
         'challenge_id': challenge_id
@@ -174,9 +217,12 @@ CTFd._internal.challenge.renew = function() {
     });
 };
 
-CTFd._internal.challenge.boot = function() {
+CTFd._internal.challenge.reset = function() {
     var challenge_id = parseInt($('#challenge-id').val());
-    var url = "/plugins/plugin-dynamic/container"
+    var url = "/plugins/plugin-dynamic/container-reload"
+
+    $('#whale-button-reset')[0].innerHTML = "Waiting...";
+    $('#whale-button-reset')[0].disabled = true;
 
     var params = {
         'challenge_id': challenge_id
@@ -205,9 +251,50 @@ CTFd._internal.challenge.boot = function() {
             loadInfo();
             CTFd.ui.ezq.ezAlert({
                 title: "Success",
-                body: "Your instance has been deployed!",
+                body: "Your instance has been reset!",
+                button: "OK"
+            });
+        } else {
+            CTFd.ui.ezq.ezAlert({
+                title: "Fail",
+                body: response.msg,
                 button: "OK"
             });
+        }
+    });
+};
+
+CTFd._internal.challenge.boot = function() {
+    var challenge_id = parseInt($('#challenge-id').val());
+    var url = "/plugins/plugin-dynamic/container"
+
+    var params = {
+        'challenge_id': challenge_id
+    };
+
+    CTFd.fetch(url, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(params)
+    }).then(function(response) {
+        if (response.status === 429) {
+            // User was ratelimited but process response
+            return response.json();
+        }
+        if (response.status === 403) {
+            // User is not logged in or CTF is paused.
+            return response.json();
+        }
+        return response.json();
+    }).then(function(response) {
+        if (response.success) {
+            $('#whale-button-boot')[0].innerHTML = "Waiting...";
+            $('#whale-button-boot')[0].disabled = true;
+            waitJob(response.job_id, "Your instance has been deployed!");
         } else {
             
             CTFd.ui.ezq.ezAlert({
@@ -1,7 +1,12 @@
 # coding=utf-8
+import datetime
 import uuid
 
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
 from .models import PluginConfigV2, ChallengeContainerV2
+from .Cache_utils import Cache_utils
 
 from CTFd.models import (
     db
@@ -9,64 +14,84 @@ from CTFd.models import (
 
 
 class DBUtils:
-    
-    port_range = []
-    MaxPort = None
-    MinPort = None
+
+    # 插件配置的进程内缓存, 以 Cache_utils 中的版本号判断是否需要重新读取
+    _configs = None
+    _configs_version = None
+    # 配置重新加载后的回调, 用于在所有 worker 上应用新配置
+    config_listeners = []
 
     @staticmethod
     def get_all_pluginconfigs():
-        configs = PluginConfigV2.query.all()
-        result = {}
+        # 先读取版本号再查询, 查询期间发生的修改会在下一次调用时被发现
+        version = Cache_utils.get_version('pluginconfigs')
+        if DBUtils._configs is None or version is None or version != DBUtils._configs_version:
+            configs = PluginConfigV2.query.all()
+            result = {}
+
+            for c in configs:
+                result[str(c.key)] = str(c.value)
 
-        for c in configs:
-            result[str(c.key)] = str(c.value)
+            if version is None:
+                version = Cache_utils.bump_version('pluginconfigs')
+            DBUtils._configs = result
+            DBUtils._configs_version = version
+            for listener in DBUtils.config_listeners:
+                listener(dict(result))
 
-        return result
+        return dict(DBUtils._configs)
 
     @staticmethod
     def save_all_pluginconfigs(configs):
-        for c in configs:
-            q = db.session.query(PluginConfigV2)
-            q = q.filter(PluginConfigV2.key == c[0])
-            record = q.one_or_none()
-
-            if record:
-                record.value = c[1]
-                db.session.commit()
-            else:
-                config = PluginConfigV2(key=c[0], value=c[1])
-                db.session.add(config)
-                db.session.commit()
+        # 一次查询取出已有的配置项, 在同一个事务中更新/插入后统一提交
+        configs = dict(configs)
+        q = db.session.query(PluginConfigV2)
+        q = q.filter(PluginConfigV2.key.in_(list(configs.keys())))
+        for record in q.all():
+            record.value = configs.pop(record.key)
+        for key, value in configs.items():
+            db.session.add(PluginConfigV2(key=key, value=value))
+        db.session.commit()
         db.session.close()
+        Cache_utils.bump_version('pluginconfigs')
 
     @staticmethod
-    def create_new_container(user_id, challenge_id, uuid, remote_info):
-        container = ChallengeContainerV2(user_id=user_id, challenge_id=challenge_id, uuid=uuid, remote_info=remote_info)
+    def create_new_container(user_id, challenge_id, uuid, remote_info, timeout):
+        # user_id/host_port 上有唯一索引, 同一用户并发创建或端口冲突时抛出 IntegrityError
+        container = ChallengeContainerV2(user_id=user_id, challenge_id=challenge_id, uuid=uuid, remote_info=remote_info, timeout=timeout)
         db.session.add(container)
-        db.session.commit()
-        db.session.close()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.close()
 
     @staticmethod
     def get_current_containers(user_id, challenge_id):
         q = db.session.query(ChallengeContainerV2)
         q = q.filter(ChallengeContainerV2.user_id == user_id)
         q = q.filter(ChallengeContainerV2.challenge_id == challenge_id)
-        records = q.all()
-        if len(records) == 0:
-            return None
-
-        return records[0]
+        return q.first()
 
     @staticmethod
     def get_container_by_user(user_id):
         q = db.session.query(ChallengeContainerV2)
         q = q.filter(ChallengeContainerV2.user_id == user_id)
-        records = q.all()
-        if len(records) == 0:
-            return None
+        return q.first()
 
-        return records[0]
+    @staticmethod
+    def get_container_by_name(container_name):
+        q = db.session.query(ChallengeContainerV2)
+        q = q.filter(ChallengeContainerV2.container_name == container_name)
+        return q.first()
+
+    @staticmethod
+    def get_container_by_port(host_port):
+        q = db.session.query(ChallengeContainerV2)
+        q = q.filter(ChallengeContainerV2.host_port == int(host_port))
+        return q.first()
 
     @staticmethod
     def remove_current_container(user_id):
@@ -80,45 +105,52 @@ class DBUtils:
         db.session.commit()
         db.session.close()
 
-    # @staticmethod
-    # def renew_current_container(user_id, challenge_id):
-    #     q = db.session.query(WhaleContainer)
-    #     q = q.filter(WhaleContainer.user_id == user_id)
-    #     q = q.filter(WhaleContainer.challenge_id == challenge_id)
-    #     records = q.all()
-    #     if len(records) == 0:
-    #         return
-
-    #     configs = DBUtils.get_all_configs()
-    #     timeout = int(configs.get("docker_timeout", "3600"))
-
-    #     r = records[0]
-    #     r.start_time = r.start_time + datetime.timedelta(seconds=timeout)
-
-    #     if r.start_time > datetime.datetime.now():
-    #         r.start_time = datetime.datetime.now()
+    @staticmethod
+    def renew_current_container(user_id, challenge_id, max_renew_count, timeout):
+        # 续期即从现在起重新计时, 续期次数达到上限后返回 False
+        q = db.session.query(ChallengeContainerV2)
+        q = q.filter(ChallengeContainerV2.user_id == user_id)
+        q = q.filter(ChallengeContainerV2.challenge_id == challenge_id)
+        r = q.first()
+        if r is None or r.renew_count >= max_renew_count:
+            db.session.close()
+            return False
 
-    #     r.renew_count += 1
-    #     db.session.commit()
-    #     db.session.close()
+        r.expires_at = datetime.datetime.now() + datetime.timedelta(seconds=timeout)
+        r.renew_count += 1
+        db.session.commit()
+        db.session.close()
+        return True
 
-    # @staticmethod
-    # def get_all_expired_container():
-    #     configs = DBUtils.get_all_configs()
-    #     timeout = int(configs.get("docker_timeout", "3600"))
+    @staticmethod
+    def get_all_expired_container():
+        # expires_at 上有索引, 这是一次范围扫描
+        q = db.session.query(ChallengeContainerV2)
+        q = q.filter(ChallengeContainerV2.expires_at < datetime.datetime.now())
+        return q.all()
 
-    #     q = db.session.query(WhaleContainer)
-    #     q = q.filter(WhaleContainer.start_time < datetime.datetime.now() - datetime.timedelta(seconds=timeout))
-    #     return q.all()
+    @staticmethod
+    def get_all_alive_container():
+        q = db.session.query(ChallengeContainerV2)
+        q = q.filter(ChallengeContainerV2.expires_at >= datetime.datetime.now())
+        return q.all()
 
-    # @staticmethod
-    # def get_all_alive_container():
-    #     configs = DBUtils.get_all_configs()
-    #     timeout = int(configs.get("docker_timeout", "3600"))
+    @staticmethod
+    def remove_containers(container_ids):
+        # 一条 DELETE 语句删除多条记录
+        if not container_ids:
+            return
+        q = db.session.query(ChallengeContainerV2)
+        q = q.filter(ChallengeContainerV2.id.in_(list(container_ids)))
+        q.delete(synchronize_session=False)
+        db.session.commit()
+        db.session.close()
 
-    #     q = db.session.query(WhaleContainer)
-    #     q = q.filter(WhaleContainer.start_time >= datetime.datetime.now() - datetime.timedelta(seconds=timeout))
-    #     return q.all()
+    @staticmethod
+    def get_used_ports():
+        q = db.session.query(ChallengeContainerV2.host_port)
+        q = q.filter(ChallengeContainerV2.host_port != None)
+        return [r[0] for r in q.all()]
 
     @staticmethod
     def get_all_container():
@@ -126,15 +158,39 @@ class DBUtils:
         return q.all()
 
     @staticmethod
-    def get_all_alive_container_page(page_start, page_end):
-        # configs = DBUtils.get_all_configs()
-        # timeout = int(configs.get("docker_timeout", "3600"))
-
+    def get_containers_by_filter(challenge_id=None, older_than=None):
         q = db.session.query(ChallengeContainerV2)
-        # q = q.filter(WhaleContainer.start_time >= datetime.datetime.now() - datetime.timedelta(seconds=timeout))
-        q = q.slice(page_start, page_end)
+        if challenge_id is not None:
+            q = q.filter(ChallengeContainerV2.challenge_id == challenge_id)
+        if older_than is not None:
+            q = q.filter(ChallengeContainerV2.start_time < datetime.datetime.now() - datetime.timedelta(seconds=older_than))
         return q.all()
 
+    @staticmethod
+    def get_container_page(limit, after=None, before=None, challenge_id=None, older_than=None):
+        # 按 id 的游标 (keyset) 分页, 不使用 OFFSET; user/challenge 随同一条查询 JOIN 取出
+        # 返回 (本页记录, 翻页方向上是否还有更多记录)
+        q = db.session.query(ChallengeContainerV2).options(
+            joinedload(ChallengeContainerV2.user),
+            joinedload(ChallengeContainerV2.challenge),
+        )
+        if challenge_id is not None:
+            q = q.filter(ChallengeContainerV2.challenge_id == challenge_id)
+        if older_than is not None:
+            q = q.filter(ChallengeContainerV2.start_time < datetime.datetime.now() - datetime.timedelta(seconds=older_than))
+        if before is not None:
+            q = q.filter(ChallengeContainerV2.id < before).order_by(ChallengeContainerV2.id.desc())
+        else:
+            if after is not None:
+                q = q.filter(ChallengeContainerV2.id > after)
+            q = q.order_by(ChallengeContainerV2.id.asc())
+        containers = q.limit(limit + 1).all()
+        has_more = len(containers) > limit
+        containers = containers[:limit]
+        if before is not None:
+            containers.reverse()
+        return containers, has_more
+
     @staticmethod
     def get_all_alive_container_count():
         # configs = DBUtils.get_all_configs()
@@ -0,0 +1,37 @@
+"""Add renew_count and start_time index to challenge_container_v2
+
+Revision ID: 4c2d9e7a1b30
+Revises:
+Create Date: 2026-10-18 10:12:40.412961
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "4c2d9e7a1b30"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    # 新安装时 create_all 已经建好了这些列和索引
+    inspector = sa.inspect(op.get_bind())
+    columns = [c["name"] for c in inspector.get_columns("challenge_container_v2")]
+    indexes = [i["name"] for i in inspector.get_indexes("challenge_container_v2")]
+    if "renew_count" not in columns:
+        op.add_column(
+            "challenge_container_v2",
+            sa.Column("renew_count", sa.Integer(), nullable=False, server_default="0"),
+        )
+    if "ix_challenge_container_v2_start_time" not in indexes:
+        op.create_index(
+            "ix_challenge_container_v2_start_time",
+            "challenge_container_v2",
+            ["start_time"],
+        )
+
+
+def downgrade(op=None):
+    op.drop_index("ix_challenge_container_v2_start_time", "challenge_container_v2")
+    op.drop_column("challenge_container_v2", "renew_count")
@@ -0,0 +1,128 @@
+"""Add container_name, host_port, expires_at and unique indexes to challenge_container_v2
+
+Revision ID: 9d3e5f1a2c47
+Revises: 4c2d9e7a1b30
+Create Date: 2026-10-18 17:41:09.208354
+
+"""
+import datetime
+
+import docker
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "9d3e5f1a2c47"
+down_revision = "4c2d9e7a1b30"
+branch_labels = None
+depends_on = None
+
+TABLE = "challenge_container_v2"
+# 与 Docker_utils.base_url 相同; 迁移脚本按路径加载, 不能导入插件模块
+DOCKER_BASE_URL = "unix://var/run/docker.sock"
+
+
+def remove_containers(names):
+    # 尽力删除容器, 返回删除失败的容器名
+    # 这些旧容器没有 MANAGED_LABEL, 对账任务看不到, 只能在这里删除
+    if not names:
+        return []
+    failed = []
+    try:
+        client = docker.DockerClient(base_url=DOCKER_BASE_URL, timeout=30)
+    except Exception:
+        return list(names)
+    for name in names:
+        try:
+            client.containers.get(name).remove(force=True)
+        except docker.errors.NotFound:
+            pass
+        except Exception:
+            failed.append(name)
+    return failed
+
+
+def upgrade(op=None):
+    # 每一步都先检查是否已经完成, 中断后可以重新执行; 新安装时 create_all 已经建好了全部列和索引
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    columns = [c["name"] for c in inspector.get_columns(TABLE)]
+    indexes = [i["name"] for i in inspector.get_indexes(TABLE)]
+
+    if "container_name" not in columns:
+        op.add_column(TABLE, sa.Column("container_name", sa.String(length=256), nullable=True))
+    if "host_port" not in columns:
+        op.add_column(TABLE, sa.Column("host_port", sa.Integer(), nullable=True))
+    if "expires_at" not in columns:
+        op.add_column(TABLE, sa.Column("expires_at", sa.DateTime(), nullable=True))
+
+    # 回填已有记录
+    configs = sa.table("plugin_config_v2", sa.column("key"), sa.column("value"))
+    timeout = bind.execute(
+        sa.select([configs.c.value]).where(configs.c.key == "docker_timeout")
+    ).scalar()
+    timeout = int(timeout) if timeout and str(timeout).isdigit() else 3600
+    rows = bind.execute(sa.text(
+        "SELECT id, user_id, uuid, remote_info, start_time FROM {0} "
+        "WHERE container_name IS NULL OR expires_at IS NULL".format(TABLE)
+    )).fetchall()
+    seen_users = set()
+    seen_ports = set(r[0] for r in bind.execute(sa.text(
+        "SELECT host_port FROM {0} WHERE host_port IS NOT NULL".format(TABLE)
+    )).fetchall())
+    duplicates = []
+    for row_id, user_id, uuid, remote_info, start_time in sorted(rows):
+        if user_id in seen_users:
+            # 历史上并发创建留下的重复记录, 只保留每个用户最早的一条, 多余的容器在下面删除
+            bind.execute(sa.text("DELETE FROM {0} WHERE id = :id".format(TABLE)), {"id": row_id})
+            duplicates.append("{0}-{1}".format(user_id, uuid))
+            continue
+        seen_users.add(user_id)
+        host_port = int(remote_info) if remote_info and remote_info.isdigit() else None
+        if host_port in seen_ports:
+            host_port = None
+        seen_ports.add(host_port)
+        if isinstance(start_time, str):
+            start_time = datetime.datetime.strptime(start_time.split(".")[0], "%Y-%m-%d %H:%M:%S")
+        bind.execute(
+            sa.text(
+                "UPDATE {0} SET container_name = :name, host_port = :port, expires_at = :expires "
+                "WHERE id = :id".format(TABLE)
+            ),
+            {
+                "name": "{0}-{1}".format(user_id, uuid),
+                "port": host_port,
+                "expires": start_time + datetime.timedelta(seconds=timeout),
+                "id": row_id,
+            },
+        )
+
+    for name, cols, unique in (
+        ("ix_challenge_container_v2_user_challenge", ["user_id", "challenge_id"], False),
+        ("ix_challenge_container_v2_user_id", ["user_id"], True),
+        ("ix_challenge_container_v2_uuid", ["uuid"], True),
+        ("ix_challenge_container_v2_container_name", ["container_name"], True),
+        ("ix_challenge_container_v2_host_port", ["host_port"], True),
+        ("ix_challenge_container_v2_expires_at", ["expires_at"], False),
+    ):
+        if name not in indexes:
+            op.create_index(name, TABLE, cols, unique=unique)
+
+    # 容器删除后, 同名的 frpc 规则由对账任务作为孤儿规则删除, 端口在下次保存设置重建端口池时回收
+    failed = remove_containers(duplicates)
+    if failed:
+        print("Failed to remove duplicate containers, remove them manually: " + ", ".join(failed))
+
+
+def downgrade(op=None):
+    for name in (
+        "ix_challenge_container_v2_expires_at",
+        "ix_challenge_container_v2_host_port",
+        "ix_challenge_container_v2_container_name",
+        "ix_challenge_container_v2_uuid",
+        "ix_challenge_container_v2_user_id",
+        "ix_challenge_container_v2_user_challenge",
+    ):
+        op.drop_index(name, TABLE)
+    op.drop_column(TABLE, "expires_at")
+    op.drop_column(TABLE, "host_port")
+    op.drop_column(TABLE, "container_name")
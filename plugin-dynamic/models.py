@@ -1,5 +1,5 @@
 from __future__ import division  # Use floating point for math calculations
-from datetime import datetime
+from datetime import datetime, timedelta
 import math
 
 from flask import Blueprint
@@ -36,12 +36,21 @@ class PluginConfigV2(db.Model):
         return "<PluginConfig (0) {1}>".format(self.key, self.value)
 
 class ChallengeContainerV2(db.Model):
+    # user_id 唯一: 每个用户同一时间只能有一个容器, 由数据库保证
+    # container_name/host_port 唯一: 按容器名或映射端口查找所属用户都是一次索引查找
+    __table_args__ = (
+        db.Index("ix_challenge_container_v2_user_challenge", "user_id", "challenge_id"),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(None, db.ForeignKey("users.id"))
+    user_id = db.Column(None, db.ForeignKey("users.id"), unique=True, index=True)
     challenge_id = db.Column(None, db.ForeignKey("challenges.id"))
-    start_time = db.Column(db.DateTime, nullable=False, default=datetime.now())
-    uuid = db.Column(db.String(256))
+    start_time = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    uuid = db.Column(db.String(256), unique=True, index=True)
+    container_name = db.Column(db.String(256), unique=True, index=True)
+    host_port = db.Column(db.Integer, unique=True, index=True, nullable=True)
     remote_info = db.Column(db.Text, nullable=True)
+    renew_count = db.Column(db.Integer, nullable=False, default=0)
 
     # Relationships
     user = db.relationship("Users", foreign_keys="ChallengeContainerV2.user_id", lazy="select")
@@ -49,12 +58,16 @@ class ChallengeContainerV2(db.Model):
         "Challenges", foreign_keys="ChallengeContainerV2.challenge_id", lazy="select"
     )
 
-    def __init__(self, user_id, challenge_id, uuid, remote_info):
+    def __init__(self, user_id, challenge_id, uuid, remote_info, timeout):
         self.user_id = user_id
         self.challenge_id = challenge_id
         self.start_time = datetime.now()
+        self.expires_at = self.start_time + timedelta(seconds=timeout)
         self.uuid = str(uuid)
+        self.container_name = str(user_id) + "-" + str(uuid)
+        self.host_port = int(remote_info) if str(remote_info).isdigit() else None
         self.remote_info = remote_info
+        self.renew_count = 0
 
     def __repr__(self):
         return "<ChallengeContainerV2 ID:(0) {1} {2} {3} {4} {5}>".format(self.id, self.user_id, self.challenge_id, self.start_time, self.uuid, self.remote_info)
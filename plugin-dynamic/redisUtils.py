@@ -0,0 +1,164 @@
+# coding=utf-8
+import json
+import threading
+import time
+import uuid
+
+import redis
+
+
+class RedisUtils:
+    # digital_port 模式的端口分配器
+    # 可用端口保存在 Redis 集合中, SPOP/SADD 保证多个 worker、多台机器之间原子且 O(1) 地分配和回收;
+    # 未配置 REDIS_URL 时退化为进程内集合 (此时只能单 worker 运行)
+    key_prefix = 'plugin-dynamic'
+    # 只有锁的值仍是自己写入的 token 时才删除, 避免锁超时后删掉其他 worker 重新获得的锁
+    release_script = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+    )
+
+    # 创建中容器的认领记录的过期时间, 需要大于对账的 grace
+    claim_timeout = 900
+
+    _pools = {}
+    _local_ports = set()
+    _local_claims = {}
+    _local_range = None
+    _local_locks = {}
+    _local_lock = threading.Lock()
+
+    def __init__(self, app):
+        redis_url = app.config.get('REDIS_URL')
+        self.redis_client = None
+        if redis_url:
+            if redis_url not in RedisUtils._pools:
+                RedisUtils._pools[redis_url] = redis.ConnectionPool.from_url(redis_url)
+            self.redis_client = redis.Redis(connection_pool=RedisUtils._pools[redis_url])
+        self.lock_tokens = {}
+        self.ports_key = RedisUtils.key_prefix + ':available_ports'
+        self.range_key = RedisUtils.key_prefix + ':port_range'
+
+    def init_redis_port_sets(self, min_port, max_port, used_ports, force=True):
+        # 以 [min_port, max_port] 减去数据库中仍在使用的端口重建可用端口集合
+        # force=False 且集合已经初始化时只做修复: 把已有范围内没有被使用的端口加回集合,
+        # 找回分配端口 (SPOP) 之后、写入记录之前崩溃而丢失的端口. used_ports 需要包含创建中容器的端口
+        if not self.acquire_lock('port-init', 30):
+            return False
+        try:
+            used_ports = set(int(p) for p in used_ports)
+            port_range = self.get_port_range()
+            if not force and port_range is not None:
+                ports = [p for p in range(port_range[0], port_range[1] + 1) if p not in used_ports]
+                if self.redis_client is None:
+                    with RedisUtils._local_lock:
+                        RedisUtils._local_ports.update(ports)
+                    return True
+                pipe = self.redis_client.pipeline()
+                for i in range(0, len(ports), 1000):
+                    pipe.sadd(self.ports_key, *ports[i:i + 1000])
+                pipe.execute()
+                return True
+            ports = [p for p in range(int(min_port), int(max_port) + 1) if p not in used_ports]
+            if self.redis_client is None:
+                with RedisUtils._local_lock:
+                    RedisUtils._local_ports = set(ports)
+                    RedisUtils._local_range = (int(min_port), int(max_port))
+                return True
+            pipe = self.redis_client.pipeline()
+            pipe.delete(self.ports_key)
+            for i in range(0, len(ports), 1000):
+                pipe.sadd(self.ports_key, *ports[i:i + 1000])
+            pipe.hmset(self.range_key, {'min': int(min_port), 'max': int(max_port)})
+            pipe.execute()
+            return True
+        finally:
+            self.release_lock('port-init')
+
+    def get_port_range(self):
+        if self.redis_client is None:
+            return RedisUtils._local_range
+        port_range = self.redis_client.hgetall(self.range_key)
+        if not port_range:
+            return None
+        return int(port_range[b'min']), int(port_range[b'max'])
+
+    def get_available_port(self):
+        if self.redis_client is None:
+            with RedisUtils._local_lock:
+                return RedisUtils._local_ports.pop() if RedisUtils._local_ports else None
+        port = self.redis_client.spop(self.ports_key)
+        return int(port) if port is not None else None
+
+    def add_available_port(self, port):
+        # 只回收当前端口范围内的端口, 修改范围后旧端口自然淘汰
+        port_range = self.get_port_range()
+        port = int(port)
+        if port_range is None or not port_range[0] <= port <= port_range[1]:
+            return
+        if self.redis_client is None:
+            with RedisUtils._local_lock:
+                RedisUtils._local_ports.add(port)
+            return
+        self.redis_client.sadd(self.ports_key, port)
+
+    def set_claim(self, container_name, claim):
+        # 记录正在创建的容器 (用户、规则、端口、认领时间), 在数据库记录写入前供对账和端口修复使用
+        key = RedisUtils.key_prefix + ':claim:' + container_name
+        if self.redis_client is None:
+            with RedisUtils._local_lock:
+                RedisUtils._local_claims[key] = (time.time() + RedisUtils.claim_timeout, dict(claim))
+            return
+        self.redis_client.set(key, json.dumps(claim), ex=int(RedisUtils.claim_timeout))
+
+    def delete_claim(self, container_name):
+        key = RedisUtils.key_prefix + ':claim:' + container_name
+        if self.redis_client is None:
+            with RedisUtils._local_lock:
+                RedisUtils._local_claims.pop(key, None)
+            return
+        self.redis_client.delete(key)
+
+    def get_claims(self):
+        # 返回 {容器名: 认领记录}
+        prefix = RedisUtils.key_prefix + ':claim:'
+        if self.redis_client is None:
+            now = time.time()
+            with RedisUtils._local_lock:
+                return dict(
+                    (key[len(prefix):], dict(claim))
+                    for key, (expires, claim) in RedisUtils._local_claims.items() if expires > now
+                )
+        keys = list(self.redis_client.scan_iter(match=prefix + '*', count=1000))
+        claims = {}
+        for key, value in zip(keys, self.redis_client.mget(keys) if keys else []):
+            if value is not None:
+                claims[key.decode()[len(prefix):]] = json.loads(value)
+        return claims
+
+    def acquire_lock(self, name, timeout):
+        # 跨 worker 的互斥锁, 超时自动释放, 防止持有者崩溃后死锁
+        key = RedisUtils.key_prefix + ':lock:' + name
+        token = str(uuid.uuid4())
+        if self.redis_client is None:
+            with RedisUtils._local_lock:
+                lock = RedisUtils._local_locks.get(key)
+                if lock is not None and lock[0] > time.time():
+                    return False
+                RedisUtils._local_locks[key] = (time.time() + timeout, token)
+        elif not self.redis_client.set(key, token, nx=True, ex=int(timeout)):
+            return False
+        self.lock_tokens[key] = token
+        return True
+
+    def release_lock(self, name):
+        key = RedisUtils.key_prefix + ':lock:' + name
+        token = self.lock_tokens.pop(key, None)
+        if token is None:
+            return
+        if self.redis_client is None:
+            with RedisUtils._local_lock:
+                lock = RedisUtils._local_locks.get(key)
+                if lock is not None and lock[1] == token:
+                    del RedisUtils._local_locks[key]
+            return
+        self.redis_client.eval(RedisUtils.release_script, 1, key, token)